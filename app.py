@@ -1,81 +1,421 @@
-from flask import Flask, redirect, render_template, request, url_for, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from refactored import Person, get_all_locations_for_group, get_location_suggestions
+from flask import Flask, Response, current_app, g, redirect, render_template, request, url_for, jsonify, stream_with_context
+from extensions import db
+from jobs import QueueFull, job_queue
+import metrics
+from profiling import request_profiler
+import importlib
+import json
 import os
+import queue
+import time
 
-app = Flask(__name__)
+# The search pipeline (refactored.py and what it pulls in: numpy, googlemaps, the caches) is
+# imported by the views on first use rather than here, so a worker can boot and serve static
+# pages without it. load_pipeline() imports it up front, e.g. in the gunicorn master (see gunicorn.conf.py)
+PIPELINE_MODULES = ("refactored", "googlemaps")
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///meetingpoints.db")
 
 # APIKEY
 GOOG_API_KEY = os.environ.get("GOOG_API_KEY")
 
-# Allows us to configure our url
-@app.route('/')
+# Longest a request may block waiting for a queued search
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 30))
+
+# Most groups one bulk search may contain
+BULK_MAX_GROUPS = int(os.environ.get("BULK_MAX_GROUPS", 100))
+
+# Seconds between keep-alive comments on an idle event stream
+STREAM_HEARTBEAT = float(os.environ.get("STREAM_HEARTBEAT", 15))
+
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.stage_timings = metrics.start_request_timings()
+    g.profiler = request_profiler.start()
+
+# Reports where the request's time went: a Server-Timing header (visible in the browser's
+# network panel) and one JSON log line per request. Streamed responses (e.g. /search/stream)
+# are logged and profiled once the whole body has been sent, including the stages of the search
+# job they stream (see g.job_timings)
+def add_request_timing(response):
+    if 'request_started' not in g:
+        return response
+    started, stage_timings, job_timings = g.request_started, g.stage_timings, g.get('job_timings')
+    profiler = g.pop('profiler', None)
+    metrics.stop_request_timings()
+    method, path, endpoint, status = request.method, request.path, request.endpoint, response.status_code
+
+    def finish() -> dict:
+        timings = dict(stage_timings)
+        for stage, seconds in (job_timings or {}).items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        timings['total'] = time.perf_counter() - started
+        profile = request_profiler.stop(profiler, f"{method} {path}")
+        if endpoint != 'static':
+            print(json.dumps({
+                'event': 'request',
+                'method': method,
+                'path': path,
+                'status': status,
+                'timings_ms': metrics.timings_ms(timings),
+                'profile': profile,
+            }))
+        return timings
+
+    if response.is_streamed:
+        # The headers go out before the body is produced, so only the log line can cover it
+        response.call_on_close(finish)
+    else:
+        response.headers['Server-Timing'] = metrics.server_timing_header(finish())
+    return response
+
 def index():
     return render_template("landing.html")
 
+def get_people_from_form(form) -> list:
+    """Extracts every fully filled-in person from the search form"""
+    people_data = []
+    i = 0
+    
+    # Extract data for each person
+    while f'person_{i}_name' in form:
+        name = form[f'person_{i}_name']
+        location = form[f'person_{i}_location']
+        transport = form[f'person_{i}_transport']
+        
+        if name and location and transport:  # Only add if all fields are filled
+            people_data.append({
+                'name': name,
+                'location': location,
+                'transport': transport
+            })
+        i += 1
+    return people_data
+
+def get_people(people_data: list) -> list:
+    """Person objects for the form data"""
+    from refactored import Person
+
+    if len(people_data) < 2:
+        raise ValueError("Please add at least 2 people to find meeting places.")
+    
+    # Create Person objects from the form data
+    people = []
+    for person_data in people_data:
+        person = Person(
+            person_data['name'], 
+            person_data['location'], 
+            person_data['transport']
+        )
+        people.append(person)
+    return people
+
+def find_meeting_places(people_data: list, place_type: str, sort_method: str, on_event=None) -> list:
+    """Runs the search pipeline for the form data and returns the recommended places"""
+    from refactored import get_all_locations_for_group
+
+    # Use the new group function
+    return get_all_locations_for_group(get_people(people_data), place_type, sort_method, on_event=on_event)
+
+def save_search(people_data: list, place_type: str, sort_method: str, places: list):
+    """
+    Stores a search's results as a Meeting (needs an app context).
+
+    Returns:
+        str: The meeting's token for its permalink, or None if there was nothing to save or saving failed
+    """
+    from refactored import save_meeting
+
+    if not places:
+        return None
+    try:
+        return save_meeting(get_people(people_data), place_type, sort_method, places).token
+    except Exception as e:
+        # The results are still shown, they just don't get a permalink
+        print(f"Error saving meeting: {e}")
+        db.session.rollback()
+        return None
+
+def find_saved_search(people_data: list, place_type: str, sort_method: str):
+    """
+    The token of a recently stored Meeting for exactly this search (see refactored.find_recent_meeting),
+    or None. Needs an app context.
+    """
+    from refactored import find_recent_meeting
+
+    if len(people_data) < 2:
+        return None  # Not a valid search, find_meeting_places reports why
+    try:
+        recent = find_recent_meeting(get_people(people_data), place_type, sort_method)
+        return recent.token if recent is not None else None
+    except Exception as e:
+        print(f"Error finding a saved meeting: {e}")
+        db.session.rollback()
+        return None
+
+def run_search_job(people_data: list, place_type: str, sort_method: str, on_event=None, flask_app=None) -> dict:
+    """
+    Job version of find_meeting_places: errors are returned (not raised) so they render like /search.
+    With flask_app the results are also saved as a Meeting, whose token is returned as meeting_token
+    """
+    try:
+        places = find_meeting_places(people_data, place_type, sort_method, on_event)
+    except ValueError as e:
+        return {'places': None, 'error': str(e), 'meeting_token': None}
+    except Exception as e:
+        return {'places': None, 'error': f"An error occurred: {str(e)}", 'meeting_token': None}
+
+    meeting_token = None
+    if flask_app is not None:
+        with flask_app.app_context():
+            meeting_token = save_search(people_data, place_type, sort_method, places)
+    return {'places': [place.to_dict() for place in places], 'error': None, 'meeting_token': meeting_token}
+
+def stream_search_job(events: queue.Queue, people_data: list, place_type: str, sort_method: str,
+                      flask_app=None) -> dict:
+    """
+    Runs a search job that also puts its progress events on events, then "meeting" if the
+    results were saved and "timings" (the job's stage durations), ending with "done"
+    """
+    result = run_search_job(people_data, place_type, sort_method,
+                            on_event=lambda event, data: events.put((event, data)), flask_app=flask_app)
+    if result['error']:
+        events.put(('error', {'error': result['error']}))
+    if result['meeting_token'] is not None:
+        events.put(('meeting', {'token': result['meeting_token']}))
+    events.put(('timings', {'timings_ms': metrics.timings_ms(metrics.current_request_timings() or {})}))
+    events.put(('done', {}))
+    return result
+
+def server_sent_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def job_status(record: dict) -> dict:
+    """Public view of a job record (without the result itself)"""
+    meeting_token = (record['result'] or {}).get('meeting_token')
+    return {
+        'job_id': record['id'],
+        'status': record['status'],
+        'wait_time': record['wait_time'],
+        'run_time': record['run_time'],
+        'result_url': url_for('search_job_result', job_id=record['id']),
+        'meeting_url': url_for('meeting', token=meeting_token) if meeting_token else None,
+        'timings_ms': metrics.timings_ms(record['timings']) if record.get('timings') else None,
+    }
+
+def people_form_data(people: list) -> list:
+    """The form data (as used by the templates) for Person objects"""
+    return [{'name': person.name, 'location': person.location, 'transport': person.transport_mode}
+            for person in people]
+
 # Route for search page
-@app.route('/search', methods=['POST','GET'])
 def search():
     if request.method == 'POST':
-        # Get form data for multiple people
-        people_data = []
-        i = 0
-        
-        # Extract data for each person
-        while f'person_{i}_name' in request.form:
-            name = request.form[f'person_{i}_name']
-            location = request.form[f'person_{i}_location']
-            transport = request.form[f'person_{i}_transport']
-            
-            if name and location and transport:  # Only add if all fields are filled
-                people_data.append({
-                    'name': name,
-                    'location': location,
-                    'transport': transport
-                })
-            i += 1
-        
+        people_data = get_people_from_form(request.form)
         place_type = request.form.get('places', 'restaurant')
         sort_method = request.form.get('sort_method', 'fairness')
         
+        # Job mode: queue the search and return its id straight away
+        if request.values.get('mode') == 'job':
+            try:
+                job_id = job_queue.submit(run_search_job, people_data, place_type, sort_method,
+                                          flask_app=current_app._get_current_object(),
+                                          meta={'people': people_data})
+            except QueueFull as e:
+                return jsonify({'error': str(e)}), 503
+            return jsonify(job_status(job_queue.get(job_id))), 202
+        
+        # Stream mode: render the page straight away and fill it in from /search/stream
+        if request.values.get('mode') == 'stream':
+            form = {key: value for key, value in request.form.items() if key != 'mode'}
+            return render_template('route.html',
+                                 places=None,
+                                 error=None,
+                                 people=people_data,
+                                 stream_url=url_for('search_stream', **form),
+                                 api_key=GOOG_API_KEY)
+        
         results = None
         error = None
 
-        try:
-            if len(people_data) < 2:
-                raise ValueError("Please add at least 2 people to find meeting places.")
-            
-            # Create Person objects from the form data
-            people = []
-            for person_data in people_data:
-                # Assuming you have a Person class in helpers
-                person = Person(
-                    person_data['name'], 
-                    person_data['location'], 
-                    person_data['transport']
-                )
-                people.append(person)
-            
-            # Use the new group function
-            results = get_all_locations_for_group(people, place_type, sort_method)
+        # The same search was just run (e.g. the form was sent again): show its stored results
+        meeting_token = find_saved_search(people_data, place_type, sort_method)
+        if meeting_token is not None:
+            return redirect(url_for('meeting', token=meeting_token), code=303)
 
+        try:
+            results = find_meeting_places(people_data, place_type, sort_method)
         except ValueError as e:
             error = str(e)
         except Exception as e:
             error = f"An error occurred: {str(e)}"
+
+        # Redirect to the stored results, so reloading or sharing the page doesn't search again
+        meeting_token = save_search(people_data, place_type, sort_method, results) if error is None else None
+        if meeting_token is not None:
+            return redirect(url_for('meeting', token=meeting_token), code=303)
         
-        return render_template('route.html', 
-                             places=results, 
-                             error=error, 
-                             people=people_data,
-                             api_key=GOOG_API_KEY)
+        with metrics.stage("render"):
+            return render_template('route.html', 
+                                 places=results, 
+                                 error=error, 
+                                 people=people_data,
+                                 api_key=GOOG_API_KEY)
 
     else:
         return render_template('search.html')
 
+# Progressive search results as Server-Sent Events. Takes the search form fields as query
+# parameters and sends "geocoded", "candidates", "scores", "pruned", "results" and "error"
+# events as the pipeline gets to them (see get_all_locations_for_group), then "done"
+def search_stream():
+    people_data = get_people_from_form(request.args)
+    place_type = request.args.get('places', 'restaurant')
+    sort_method = request.args.get('sort_method', 'fairness')
+
+    events = queue.Queue()
+    job = None
+    # Filled from the job's "timings" event, for this request's log line (see add_request_timing)
+    job_timings = g.job_timings = {}
+    try:
+        job_id = job_queue.submit(stream_search_job, events, people_data, place_type, sort_method,
+                                  flask_app=current_app._get_current_object(), meta={'people': people_data})
+        job = job_status(job_queue.get(job_id))
+    except QueueFull as e:
+        events.put(('error', {'error': str(e)}))
+        events.put(('done', {}))
+
+    def generate():
+        # The job id comes first, even if the search has already queued events
+        if job is not None:
+            yield server_sent_event('job', job)
+        while True:
+            try:
+                event, data = events.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event == 'meeting':
+                data = {'url': url_for('meeting', token=data['token'])}
+            if event == 'timings':
+                job_timings.update({stage: ms / 1000 for stage, ms in data['timings_ms'].items()})
+            yield server_sent_event(event, data)
+            if event == 'done':
+                return
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Every scored candidate for a search (same fields as the search form, as form data or query
+# parameters) in columnar JSON, so the page can re-rank, filter and paginate without another search
+def search_api():
+    from refactored import candidates_to_columns, get_all_candidates_for_group
+
+    people_data = get_people_from_form(request.values)
+    place_type = request.values.get('places', 'restaurant')
+    try:
+        people = get_people(people_data)
+        return jsonify(candidates_to_columns(people, get_all_candidates_for_group(people, place_type)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f"An error occurred: {str(e)}"}), 500
+
+# Searches for many groups at once, sharing geocoding, Places searches and Distance Matrix cells
+# between them. Takes JSON: {"places", "sort_method", "max_results", "groups": [{"name", "places",
+# "people": [{"name", "location", "transport"}]}]}, where a group's "places" overrides the default
+def bulk_search_api():
+    from refactored import Person, get_all_locations_for_groups
+
+    data = request.get_json(silent=True) or {}
+    groups_data = data.get('groups')
+    if not isinstance(groups_data, list) or not groups_data:
+        return jsonify({'error': "Please send a list of groups."}), 400
+    if len(groups_data) > BULK_MAX_GROUPS:
+        return jsonify({'error': f"Please send at most {BULK_MAX_GROUPS} groups at a time."}), 400
+
+    place_type = data.get('places', 'restaurant')
+    sort_method = data.get('sort_method', 'fairness')
+    try:
+        max_results = int(data.get('max_results', 6))
+        people_data = [[{'name': person['name'], 'location': person['location'], 'transport': person['transport']}
+                        for person in group['people']] for group in groups_data]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': "Every group needs people, each with a name, location and transport."}), 400
+    place_types = [group.get('places') or place_type for group in groups_data]
+
+    stats = {}
+    try:
+        groups = [[Person(person['name'], person['location'], person['transport']) for person in people]
+                  for people in people_data]
+        results = get_all_locations_for_groups(groups, place_types, sort_method, max_results, stats=stats)
+    except Exception as e:
+        return jsonify({'error': f"An error occurred: {str(e)}"}), 500
+
+    response = []
+    for group, people, group_place_type, (places, error) in zip(groups_data, people_data, place_types, results):
+        meeting_token = save_search(people, group_place_type, sort_method, places)
+        response.append({
+            'name': group.get('name'),
+            'places': [dict(place.to_dict(), key=place.key) for place in places] if places is not None else None,
+            'error': error,
+            'meeting_url': url_for('meeting', token=meeting_token, _external=True) if meeting_token else None,
+        })
+    return jsonify({'groups': response, 'stats': stats})
+
+# Poll a queued search. ?wait=N blocks for up to N seconds until it finishes
+def search_job_status(job_id):
+    wait = min(request.args.get('wait', 0, type=float), JOB_MAX_WAIT)
+    record = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if record is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_status(record))
+
+# Rendered result of a queued search (waits for it to finish if needed)
+def search_job_result(job_id):
+    from refactored import Place
+
+    record = job_queue.wait(job_id, JOB_MAX_WAIT)
+    if record is None:
+        return render_template('route.html', places=None, error="This search has expired, please search again.",
+                               people=None, api_key=GOOG_API_KEY), 404
+    if record['status'] not in ('done', 'failed'):
+        return jsonify(job_status(record)), 202
+    
+    result = record['result'] or {'places': None, 'error': record['error']}
+    places = [Place.from_dict(place) for place in result['places']] if result['places'] else None
+    meeting_token = result.get('meeting_token')
+    return render_template('route.html',
+                           places=places,
+                           error=result['error'],
+                           people=record['meta'].get('people'),
+                           permalink=url_for('meeting', token=meeting_token, _external=True) if meeting_token else None,
+                           api_key=GOOG_API_KEY)
+
+# Permalink to a stored search, served from the database without calling the Maps APIs
+def meeting(token):
+    from refactored import get_meeting
+
+    stored = get_meeting(token)
+    if stored is None:
+        return render_template('route.html', places=None, error="This meeting doesn't exist, please search again.",
+                               people=None, api_key=GOOG_API_KEY), 404
+    with metrics.stage("render"):
+        return render_template('route.html',
+                               places=stored.get_places(),
+                               error=None,
+                               people=people_form_data(stored.get_people_data()),
+                               permalink=url_for('meeting', token=stored.token, _external=True),
+                               api_key=GOOG_API_KEY)
+
+# Prometheus metrics for this worker process
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # API endpoint for location autocomplete
-@app.route('/api/autocomplete')
 def autocomplete():
+    from refactored import get_location_suggestions
+
     query = request.args.get('q', '')
     if not query or len(query) < 3:
         return jsonify([])
@@ -88,5 +428,52 @@ def autocomplete():
         print(f"Autocomplete error: {e}")
         return jsonify([])
 
+def load_pipeline() -> int:
+    """
+    Imports the search pipeline now instead of on the first search, and warms the geocoding cache.
+
+    Returns:
+        int: Number of addresses loaded into the geocoding cache
+    """
+    for module in PIPELINE_MODULES:
+        importlib.import_module(module)
+    from refactored import warm_geocoding_cache
+    return warm_geocoding_cache()
+
+def create_app(config: dict = None) -> Flask:
+    """
+    Builds the Flask app: binds the database and registers the request hooks and routes.
+
+    Args:
+        config (dict): Settings to override on app.config (e.g. SQLALCHEMY_DATABASE_URI)
+
+    Returns:
+        Flask: The app
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+    if config:
+        app.config.update(config)
+    db.init_app(app)
+
+    app.before_request(start_request_timing)
+    app.after_request(add_request_timing)
+
+    # Endpoint names are the view function names, as used by url_for in the templates
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/search', view_func=search, methods=['POST', 'GET'])
+    app.add_url_rule('/search/stream', view_func=search_stream)
+    app.add_url_rule('/api/search', view_func=search_api, methods=['GET', 'POST'])
+    app.add_url_rule('/api/bulk-search', view_func=bulk_search_api, methods=['POST'])
+    app.add_url_rule('/api/jobs/<job_id>', view_func=search_job_status)
+    app.add_url_rule('/jobs/<job_id>', view_func=search_job_result)
+    app.add_url_rule('/meeting/<token>', view_func=meeting)
+    app.add_url_rule('/metrics', view_func=metrics_endpoint)
+    app.add_url_rule('/api/autocomplete', view_func=autocomplete)
+    return app
+
+# For `gunicorn app:app` (see Procfile) and `flask run`
+app = create_app()
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+import metrics
+from transport import get_session, get_timeout
+
+AUTOCOMPLETE_URL = "https://maps.googleapis.com/maps/api/place/autocomplete/json"
+
+# Google returns at most this many predictions per query
+MAX_PREDICTIONS = 5
+
+# Shortest query that is sent to Google (shorter prefixes aren't useful)
+MIN_QUERY_LENGTH = 3
+
+# Statuses whose predictions are an answer to the query and can be cached; anything else
+# (OVER_QUERY_LIMIT, REQUEST_DENIED, UNKNOWN_ERROR...) is returned as no suggestions but not stored
+CACHEABLE_STATUSES = {"OK", "ZERO_RESULTS"}
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def matches(query: str, description: str) -> bool:
+    """Whether every word of query starts a word of description, e.g. "geo st syd" and "George St, Sydney" """
+    words = description.lower().replace(',', ' ').split()
+    return all(any(word.startswith(part) for word in words) for part in query.split())
+
+
+class AutocompleteCache:
+    """
+    Serves /api/autocomplete suggestions with as few Places Autocomplete calls as possible.
+
+    - Recent predictions are kept in an LRU keyed by the normalized query.
+    - A longer query is answered locally by filtering a cached shorter prefix, as long
+      as that prefix's predictions can still be trusted (see _from_prefix).
+    - Identical queries that arrive while one is already in flight wait for it
+      instead of making their own call.
+    - Calls go through the shared, pooled transport (see transport.py).
+    """
+    def __init__(self, max_entries: int = 5000, ttl: float = 24 * 3600, session: requests.Session = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.session = session
+
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._entries = OrderedDict()  # {normalized query: (predictions, stored_at)}
+        self._in_flight = {}  # {normalized query: Future}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _from_prefix(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Answers key from the longest cached prefix of it. Only trusted when the prefix
+        returned fewer than MAX_PREDICTIONS results (so nothing was cut off) or when
+        every one of its predictions still matches the longer query.
+        """
+        for length in range(len(key) - 1, MIN_QUERY_LENGTH - 1, -1):
+            predictions = self._lookup(key[:length])
+            if predictions is None:
+                continue
+            filtered = [p for p in predictions if matches(key, p['description'])]
+            if filtered and (len(predictions) < MAX_PREDICTIONS or len(filtered) == len(predictions)):
+                return filtered
+            return None
+        return None
+
+    def _store(self, key: str, predictions: List[Dict[str, Any]]):
+        self._entries[key] = (predictions, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _fetch(self, query: str, api_key: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """The predictions for query, and whether they can be cached (see CACHEABLE_STATUSES)"""
+        params = {
+            'input': query,
+            'key': api_key,
+            'components': 'country:au',  # Restrict to Australia
+            'types': 'address'
+        }
+        session = self.session or get_session()
+        with metrics.track_call("places_autocomplete") as outcome:
+            response = session.get(AUTOCOMPLETE_URL, params=params, timeout=get_timeout())
+            response.raise_for_status()
+            outcome["result"] = data = response.json()
+
+        predictions = []
+        if data.get('status') == 'OK':
+            for prediction in data.get('predictions', []):
+                predictions.append({
+                    'description': prediction.get('description', ''),
+                    'place_id': prediction.get('place_id', '')
+                })
+        elif data.get('status') not in CACHEABLE_STATUSES:
+            print(f"Autocomplete failed for {query!r}: {data.get('status')}")
+        return predictions, data.get('status') in CACHEABLE_STATUSES
+
+    def get(self, query: str, api_key: str) -> List[Dict[str, Any]]:
+        """Suggestions for query (at most MAX_PREDICTIONS)"""
+        key = normalize_query(query)
+        with self._lock:
+            predictions = self._lookup(key)
+            if predictions is not None:
+                self.hits += 1
+                return predictions[:MAX_PREDICTIONS]
+            predictions = self._from_prefix(key)
+            if predictions is not None:
+                self.prefix_hits += 1
+                return predictions[:MAX_PREDICTIONS]
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()[:MAX_PREDICTIONS]
+
+        try:
+            predictions, cacheable = self._fetch(query, api_key)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if cacheable:
+                self._store(key, predictions)
+            del self._in_flight[key]
+        future.set_result(predictions)
+        return predictions[:MAX_PREDICTIONS]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "prefix_hits": self.prefix_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "entries": len(self._entries),
+            }
+
+
+autocomplete_cache = AutocompleteCache(
+    max_entries=int(os.environ.get("AUTOCOMPLETE_CACHE_SIZE", 5000)),
+    ttl=float(os.environ.get("AUTOCOMPLETE_CACHE_TTL", 24 * 3600)),
+)
+
+
+def collect_autocomplete_metrics():
+    stats = autocomplete_cache.stats()
+    yield ("autocomplete_lookups_total", "counter", "Autocomplete queries by how they were answered",
+           [({"result": result}, stats[result]) for result in ("hits", "prefix_hits", "misses", "coalesced")])
+
+
+metrics.registry.add_collector(collect_autocomplete_metrics)
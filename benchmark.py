@@ -0,0 +1,259 @@
+"""
+End-to-end benchmark of the search pipeline, run against the offline replay Maps backend
+(see maps_backend.py), so it needs no network access or API key.
+
+For every group size it times get_all_locations_for_group with cold caches, again with warm
+caches and once more with a different sort method, and counts the Maps calls and Distance
+Matrix elements each run makes. The legacy helpers.get_all_locations_classes only supports
+two people, so it is benchmarked for groups of two.
+
+For every number of groups it also runs an office's team lunches cold, once one group at a time
+and once through the bulk get_all_locations_for_groups, and fails unless the bulk run makes
+fewer Distance Matrix requests.
+
+For every meetup size it runs a large group drawn from a few neighbourhoods cold, once with
+exact travel times for everyone and once with clustered origins (see refactored.cluster_origins),
+and fails if clustering makes more Maps calls or Distance Matrix requests.
+
+    python benchmark.py
+    python benchmark.py --sizes 2 10 25 --groups 5 40 --meetups 60 120 --latency 0.1 --json bench.json
+    python benchmark.py --baseline bench.json          # exits with 1 if calls or elements went up
+    python benchmark.py --baseline bench.json --time-tolerance 1.5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Set before the app modules build their Maps client and open their caches
+os.environ.setdefault("MAPS_BACKEND", "replay")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="meet-benchmark-"), "cache.db"))
+
+import helpers
+import refactored
+from cache import PersistentCache
+from maps_backend import MAPS_FIXTURE_DIR, ReplayClient
+
+DEFAULT_SIZES = (2, 3, 5, 10, 15, 20, 25)
+DEFAULT_GROUP_COUNTS = (5, 20)
+DEFAULT_MEETUP_SIZES = (60,)
+# No walkers: someone walking across the whole synthetic city can't reach anywhere in time,
+# which would leave the large groups without results
+MODES = ("driving", "transit", "bicycling")
+PLACE_TYPE = "cafe"
+
+
+def make_group(size: int) -> list:
+    """A deterministic group of people with distinct addresses and a mix of transport modes"""
+    return [refactored.Person(f"Person {i + 1}", f"{i + 1} Benchmark Road, Suburb {i + 1}", MODES[i % len(MODES)])
+            for i in range(size)]
+
+
+def make_office_groups(count: int, size: int = 4) -> list:
+    """
+    Deterministic team lunches: everyone but one person per team leaves from the office (by a
+    mix of modes), the last joins from one of a few client sites, so addresses, search areas
+    and travel times overlap between teams
+    """
+    groups = []
+    for g in range(count):
+        team = [refactored.Person(f"Team {g + 1} member {i + 1}", "1 Office Plaza, City", MODES[(g + i) % len(MODES)])
+                for i in range(size - 1)]
+        site = g % 6
+        team.append(refactored.Person(f"Team {g + 1} guest", f"{site + 1} Client Street, Suburb {site + 1}",
+                                      MODES[(g // 6) % len(MODES)]))
+        groups.append(team)
+    return groups
+
+
+def make_meetup_group(size: int, neighbourhoods: int = 6) -> list:
+    """A deterministic large group whose members live in a few neighbourhoods"""
+    return [refactored.Person(f"Member {i + 1}", f"{i + 1} Meetup Lane, Suburb {i % neighbourhoods + 1}",
+                              MODES[(i // neighbourhoods) % len(MODES)])
+            for i in range(size)]
+
+
+def clear_caches():
+    for cache in PersistentCache.instances:
+        cache.clear()
+
+
+def run_scenario(client: ReplayClient, name: str, size: int, search, verbose: bool = False) -> dict:
+    client.reset_counts()
+    # The pipeline prints progress; keep it out of the report unless asked for
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        start = time.perf_counter()
+        results = search()
+        wall_time = time.perf_counter() - start
+    return {
+        "scenario": name,
+        "people": size,
+        "wall_time": wall_time,
+        "calls": sum(client.calls.values()),
+        "calls_by_method": dict(client.calls),
+        "elements": client.elements,
+        "results": len(results),
+        # Quality of the answer: the longest trip to the top place (None if it isn't known)
+        "best_max_time": getattr(results[0], "max_travel_time", None) if results else None,
+        "replayed": client.replayed,
+    }
+
+
+def run_benchmarks(client: ReplayClient, sizes, group_counts=(), meetup_sizes=(), verbose: bool = False) -> list:
+    scenarios = []
+    for size in sizes:
+        clear_caches()
+        search = lambda strategy: refactored.get_all_locations_for_group(make_group(size), PLACE_TYPE, strategy)
+        scenarios.append(run_scenario(client, f"group-{size}-cold", size, lambda: search("fairness"), verbose))
+        scenarios.append(run_scenario(client, f"group-{size}-warm", size, lambda: search("fairness"), verbose))
+        scenarios.append(run_scenario(client, f"group-{size}-resort", size, lambda: search("minimize_max"), verbose))
+
+        if size == 2:
+            people = make_group(2)
+            scenarios.append(run_scenario(client, "legacy-2", 2, lambda: helpers.get_all_locations_classes(
+                people[0].location, people[1].location, people[0].transport_mode, people[1].transport_mode,
+                PLACE_TYPE), verbose))
+
+    for count in group_counts:
+        clear_caches()
+        scenarios.append(run_scenario(client, f"office-{count}-separate", count * 4, lambda: [
+            place for group in make_office_groups(count)
+            for place in refactored.get_all_locations_for_group(group, PLACE_TYPE)], verbose))
+        clear_caches()
+        scenarios.append(run_scenario(client, f"office-{count}-bulk", count * 4, lambda: [
+            place for places, _ in refactored.get_all_locations_for_groups(make_office_groups(count),
+                                                                           [PLACE_TYPE] * count)
+            for place in places or []], verbose))
+
+    large_group_size = refactored.LARGE_GROUP_SIZE
+    for size in meetup_sizes:
+        search = lambda: refactored.get_all_locations_for_group(make_meetup_group(size), PLACE_TYPE)
+        try:
+            clear_caches()
+            refactored.LARGE_GROUP_SIZE = 0
+            scenarios.append(run_scenario(client, f"meetup-{size}-exact", size, search, verbose))
+        finally:
+            refactored.LARGE_GROUP_SIZE = large_group_size
+        clear_caches()
+        scenarios.append(run_scenario(client, f"meetup-{size}-clustered", size, search, verbose))
+    return scenarios
+
+
+def print_table(scenarios: list):
+    header = (f"{'scenario':<20}{'people':>7}{'wall ms':>10}{'calls':>7}{'geocode':>9}{'places':>8}{'matrix':>8}"
+              f"{'elements':>10}{'results':>9}{'best max':>10}")
+    print(header)
+    print("-" * len(header))
+    for s in scenarios:
+        calls = s["calls_by_method"]
+        print(f"{s['scenario']:<20}{s['people']:>7}{s['wall_time'] * 1000:>10.1f}{s['calls']:>7}"
+              f"{calls.get('geocode', 0):>9}{calls.get('places_nearby', 0):>8}{calls.get('distance_matrix', 0):>8}"
+              f"{s['elements']:>10}{s['results']:>9}"
+              f"{'-' if s['best_max_time'] is None else str(round(s['best_max_time'] / 60)) + ' min':>10}")
+
+
+def compare(scenarios: list, baseline: list, time_tolerance: float = None) -> list:
+    """Regressions against a baseline run: more calls or elements, or (optionally) slower by time_tolerance"""
+    previous = {s["scenario"]: s for s in baseline}
+    regressions = []
+    for s in scenarios:
+        old = previous.get(s["scenario"])
+        if old is None:
+            continue
+        for metric in ("calls", "elements"):
+            if s[metric] > old[metric]:
+                regressions.append(f"{s['scenario']}: {metric} {old[metric]} -> {s[metric]}")
+        if time_tolerance and s["wall_time"] > old["wall_time"] * time_tolerance:
+            regressions.append(f"{s['scenario']}: wall time {old['wall_time'] * 1000:.1f}ms -> {s['wall_time'] * 1000:.1f}ms")
+    return regressions
+
+
+def check_expectations(scenarios: list) -> list:
+    """Failures of the comparisons the benchmark exists to show, e.g. bulk searches sharing requests"""
+    by_name = {s["scenario"]: s for s in scenarios}
+    failures = []
+    for name, s in by_name.items():
+        if not name.endswith("-clustered"):
+            continue
+        exact = by_name.get(name[:-len("clustered")] + "exact")
+        if exact is None:
+            continue
+        for label, count in (("Maps calls", lambda run: run["calls"]),
+                             ("Distance Matrix requests", lambda run: run["calls_by_method"].get("distance_matrix", 0))):
+            if count(s) > count(exact):
+                failures.append(f"{name}: {count(s)} {label}, more than {count(exact)} with exact travel times")
+    for name, s in by_name.items():
+        if not name.endswith("-bulk"):
+            continue
+        separate = by_name.get(name[:-len("bulk")] + "separate")
+        if separate is None:
+            continue
+        bulk_requests = s["calls_by_method"].get("distance_matrix", 0)
+        separate_requests = separate["calls_by_method"].get("distance_matrix", 0)
+        if bulk_requests >= separate_requests:
+            failures.append(f"{name}: {bulk_requests} Distance Matrix requests, "
+                            f"not fewer than {separate_requests} when run separately")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the search pipeline offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Group sizes to run")
+    parser.add_argument("--groups", type=int, nargs="*", default=DEFAULT_GROUP_COUNTS,
+                        help="Numbers of groups to run one at a time and in bulk")
+    parser.add_argument("--meetups", type=int, nargs="*", default=DEFAULT_MEETUP_SIZES,
+                        help="Large group sizes to run with exact and clustered travel times")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per Maps call")
+    parser.add_argument("--element-latency", type=float, default=0.0005,
+                        help="Simulated extra seconds per Distance Matrix element")
+    parser.add_argument("--fixtures", default=MAPS_FIXTURE_DIR, help="Recorded responses to replay")
+    parser.add_argument("--missing", choices=("synthetic", "error"), default="synthetic",
+                        help="What to do with requests that weren't recorded")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against results written earlier with --json")
+    parser.add_argument("--time-tolerance", type=float,
+                        help="Also fail when a scenario is this many times slower than the baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args(argv)
+
+    client = ReplayClient(args.fixtures, latency=args.latency, element_latency=args.element_latency,
+                          missing=args.missing)
+    refactored.gmaps = client
+    helpers.gmaps = client
+
+    scenarios = run_benchmarks(client, args.sizes, args.groups, args.meetups, args.verbose)
+    print_table(scenarios)
+    replayed = sum(s["replayed"] for s in scenarios)
+    if replayed:
+        print(f"\n{replayed} of {sum(s['calls'] for s in scenarios)} responses replayed from {args.fixtures}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(scenarios, f, indent=1)
+
+    failures = check_expectations(scenarios)
+    if failures:
+        print("\nFailed expectations:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(scenarios, json.load(f), args.time_tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
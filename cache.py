@@ -0,0 +1,383 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import metrics
+
+# All persistent caches share one SQLite file in the Flask instance folder so
+# every gunicorn worker (and every restart) sees the same entries.
+CACHE_DB_PATH = os.environ.get(
+    "CACHE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "cache.db"),
+)
+
+# Hits served from memory are written to SQLite's last_used/use_count in batches: with the
+# next write, or at the next hit once this many seconds have passed
+USAGE_FLUSH_INTERVAL = float(os.environ.get("CACHE_USAGE_FLUSH_INTERVAL", 30))
+
+# Writes between exact row counts; in between, the count is estimated from this process's writes
+EVICTION_CHECK_INTERVAL = 100
+# A full table is evicted down to this fraction of max_entries, so eviction runs in batches
+EVICTION_LOW_WATERMARK = 0.9
+
+
+class PersistentCache:
+    """
+    Two-tier key/value cache: a small in-process LRU in front of a SQLite table.
+
+    The SQLite tier is shared between worker processes, survives restarts, is
+    bounded to max_entries (least recently used rows are evicted first, in batches
+    once the table is over the limit) and expires rows older than ttl seconds.
+    Values must be JSON serialisable.
+
+    Hits in the in-process tier still count towards the row's last_used and use_count
+    (see USAGE_FLUSH_INTERVAL), so the hottest keys are the last to be evicted and the
+    first to be warmed.
+    """
+    # Every cache created in this process, for /metrics
+    instances = []
+
+    def __init__(self, table: str, max_entries: int = 10000, ttl: float = 30 * 24 * 3600,
+                 memory_entries: int = 1000, path: str = None):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.path = path or CACHE_DB_PATH
+
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()  # {key: (value, stored_at)}
+        self._pending_usage = {}  # {key: [last used, hits]} for memory hits not yet in SQLite
+        self._last_flush = time.time()
+        self._row_estimate = None  # Rows in the SQLite table, as far as this process knows
+        self._writes_since_count = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._initialised = False
+        PersistentCache.instances.append(self)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread; SQLite connections can't be shared across threads, nor
+        across a fork (e.g. one opened in the gunicorn master while preloading)
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._initialised:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, last_used REAL NOT NULL, "
+                "use_count INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+            conn.commit()
+            self._initialised = True
+        return conn
+
+    def _remember(self, key: str, value: Any, stored_at: float):
+        with self._lock:
+            self._memory[key] = (value, stored_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _record_usage(self, key: str, now: float):
+        """Notes a memory hit for the next flush (call with self._lock held)"""
+        usage = self._pending_usage.setdefault(key, [now, 0])
+        usage[0] = now
+        usage[1] += 1
+
+    def _flush_usage(self, conn: sqlite3.Connection):
+        """Writes the pending memory hits to SQLite; the caller commits"""
+        with self._lock:
+            pending, self._pending_usage = self._pending_usage, {}
+            self._last_flush = time.time()
+        if pending:
+            conn.executemany(
+                f"UPDATE {self.table} SET last_used = MAX(last_used, ?), use_count = use_count + ? WHERE key = ?",
+                [(last_used, hits, key) for key, (last_used, hits) in pending.items()],
+            )
+
+    def _flush_usage_if_due(self, now: float):
+        if now - self._last_flush < USAGE_FLUSH_INTERVAL:
+            return
+        try:
+            conn = self._connection()
+            self._flush_usage(conn)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Cache write error ({self.table}): {e}")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value for key, or default on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self._record_usage(key, now)
+                self.hits += 1
+                memory_hit = True
+            else:
+                memory_hit = False
+        if memory_hit:
+            self._flush_usage_if_due(now)
+            return entry[0]
+
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                if row is not None:
+                    conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    conn.commit()
+                with self._lock:
+                    self._memory.pop(key, None)
+                    self.misses += 1
+                return default
+
+            conn.execute(
+                f"UPDATE {self.table} SET last_used = ?, use_count = use_count + 1 WHERE key = ?",
+                (now, key),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Cache read error ({self.table}): {e}")
+            with self._lock:
+                self.misses += 1
+            return default
+
+        value = json.loads(row[0])
+        self._remember(key, value, row[1])
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        """Store value under key, evicting the least recently used rows past max_entries"""
+        now = time.time()
+        self._remember(key, value, now)
+        try:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT INTO {self.table} (key, value, stored_at, last_used, use_count) "
+                "VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+                "stored_at = excluded.stored_at, last_used = excluded.last_used",
+                (key, json.dumps(value), now, now),
+            )
+            self._flush_usage(conn)
+            self._evict_if_full(conn, 1)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Cache write error ({self.table}): {e}")
+
+    def _evict_if_full(self, conn: sqlite3.Connection, added: int):
+        """
+        Evicts the least recently used rows once the table is over max_entries; the caller commits.
+
+        The table is only counted every EVICTION_CHECK_INTERVAL writes, or when the estimate
+        says it is full, so most writes don't scan it.
+        """
+        with self._lock:
+            self._writes_since_count += 1
+            if self._row_estimate is not None:
+                self._row_estimate += added  # Updates of existing keys count too, so this errs high
+            if (self._row_estimate is not None and self._row_estimate <= self.max_entries
+                    and self._writes_since_count < EVICTION_CHECK_INTERVAL):
+                return
+            self._writes_since_count = 0
+        rows = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if rows > self.max_entries:
+            keep = int(self.max_entries * EVICTION_LOW_WATERMARK)
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (keep,),
+            )
+            rows = keep
+        with self._lock:
+            self._row_estimate = rows
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Looks up many keys with a single query. Returns {key: value} for the keys that
+        were found; missing and expired keys are left out.
+        """
+        now = time.time()
+        found = {}
+        remaining = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._memory.get(key)
+                if entry is not None and now - entry[1] < self.ttl:
+                    self._memory.move_to_end(key)
+                    self._record_usage(key, now)
+                    found[key] = entry[0]
+                else:
+                    remaining.append(key)
+        if found:
+            self._flush_usage_if_due(now)
+
+        rows = []
+        if remaining:
+            try:
+                conn = self._connection()
+                # Stay well under SQLite's bound parameter limit
+                for start in range(0, len(remaining), 500):
+                    chunk = remaining[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows.extend(conn.execute(
+                        f"SELECT key, value, stored_at FROM {self.table} "
+                        f"WHERE key IN ({placeholders}) AND stored_at > ?",
+                        (*chunk, now - self.ttl),
+                    ).fetchall())
+                if rows:
+                    conn.executemany(
+                        f"UPDATE {self.table} SET last_used = ?, use_count = use_count + 1 WHERE key = ?",
+                        [(now, row[0]) for row in rows],
+                    )
+                    conn.commit()
+            except sqlite3.Error as e:
+                print(f"Cache read error ({self.table}): {e}")
+                rows = []
+
+        for key, value, stored_at in rows:
+            found[key] = json.loads(value)
+            self._remember(key, found[key], stored_at)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def set_many(self, items: Dict[str, Any]):
+        """Stores every {key: value} pair in a single transaction"""
+        if not items:
+            return
+        now = time.time()
+        for key, value in items.items():
+            self._remember(key, value, now)
+        try:
+            conn = self._connection()
+            conn.executemany(
+                f"INSERT INTO {self.table} (key, value, stored_at, last_used, use_count) "
+                "VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+                "stored_at = excluded.stored_at, last_used = excluded.last_used",
+                [(key, json.dumps(value), now, now) for key, value in items.items()],
+            )
+            self._flush_usage(conn)
+            self._evict_if_full(conn, len(items))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Cache write error ({self.table}): {e}")
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def warm(self, limit: int = None) -> int:
+        """
+        Load the most frequently used, unexpired entries into the in-process tier.
+
+        Intended to be called once per worker at start-up. Returns the number of entries loaded.
+        """
+        limit = self.memory_entries if limit is None else min(limit, self.memory_entries)
+        try:
+            conn = self._connection()
+            self._flush_usage(conn)
+            conn.commit()
+            rows = conn.execute(
+                f"SELECT key, value, stored_at FROM {self.table} WHERE stored_at > ? "
+                "ORDER BY use_count DESC LIMIT ?",
+                (time.time() - self.ttl, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Cache warm error ({self.table}): {e}")
+            return 0
+
+        # Insert least used first so the most used end up most recently used
+        for key, value, stored_at in reversed(rows):
+            self._remember(key, json.loads(value), stored_at)
+        return len(rows)
+
+    def clear(self):
+        """Remove every entry from both tiers and reset the counters"""
+        with self._lock:
+            self._memory.clear()
+            self._pending_usage.clear()
+            self._row_estimate = None
+            self.hits = 0
+            self.misses = 0
+        try:
+            conn = self._connection()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Cache clear error ({self.table}): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus the current size of each tier"""
+        try:
+            size = self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": size,
+            }
+
+    def most_used(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """The most frequently requested keys and how often they were used"""
+        try:
+            conn = self._connection()
+            self._flush_usage(conn)
+            conn.commit()
+            return conn.execute(
+                f"SELECT key, use_count FROM {self.table} ORDER BY use_count DESC LIMIT ?", (limit,)
+            ).fetchall()
+        except sqlite3.Error:
+            return []
+
+
+def collect_cache_metrics():
+    """Hit/miss counters and memory tier sizes of every PersistentCache in this process, for metrics.registry"""
+    caches = PersistentCache.instances
+    yield ("cache_hits_total", "counter", "Cache lookups answered from the cache",
+           [({"cache": cache.table}, cache.hits) for cache in caches])
+    yield ("cache_misses_total", "counter", "Cache lookups that missed",
+           [({"cache": cache.table}, cache.misses) for cache in caches])
+    yield ("cache_entries", "gauge", "Entries held by each cache tier",
+           [({"cache": cache.table, "tier": "memory"}, len(cache._memory)) for cache in caches])
+
+
+def collect_cache_disk_metrics():
+    """Sizes of the SQLite tables every worker shares, so they aren't summed over workers"""
+    stats = [(cache.table, cache.stats()) for cache in PersistentCache.instances]
+    yield ("cache_entries", "gauge", "Entries held by each cache tier",
+           [({"cache": table, "tier": "disk"}, s["disk_entries"]) for table, s in stats
+            if s["disk_entries"] is not None])
+
+
+metrics.registry.add_collector(collect_cache_metrics)
+metrics.registry.add_collector(collect_cache_disk_metrics, shared=True)
@@ -0,0 +1,353 @@
+import math
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+from cache import PersistentCache
+from geometry import Coord
+
+# Distance Matrix API per-request limits
+# https://developers.google.com/maps/documentation/distance-matrix/usage-and-billing
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+# Maximum number of concurrent Distance Matrix requests per search
+MATRIX_WORKERS = int(os.environ.get("MATRIX_WORKERS", 8))
+
+# (origins, destinations, mode) - one full matrix to compute
+MatrixJob = Tuple[List[Coord], List[Coord], str]
+
+# Cached "no route" cells, so they aren't requested again either
+NO_ROUTE = -1
+
+# Modes whose travel times depend on the time of day
+TIME_DEPENDENT_MODES = {"driving", "transit"}
+
+
+class TravelTimeCache:
+    """
+    Caches individual Distance Matrix cells.
+
+    Origins and destinations are snapped to a grid of `precision` decimal places
+    (3 is roughly 100m), so people in the same street and venues in the same block
+    share entries. Driving and transit times are also keyed by a time-of-day bucket
+    of `bucket_minutes`, because traffic and timetables change over the day.
+    Destinations that share a cell with another destination of the same matrix are keyed
+    on a grid `fine_precision` decimal places finer instead (see get_travel_time_matrices),
+    so nearby venues keep their own times and can still be ranked against each other.
+    """
+    def __init__(self, precision: int = 3, ttl: float = 7 * 24 * 3600, bucket_minutes: int = 60,
+                 max_entries: int = 200000):
+        self.precision = precision
+        self.bucket_minutes = bucket_minutes
+        self.store = PersistentCache("travel_time", max_entries=max_entries, ttl=ttl, memory_entries=20000)
+
+    fine_precision = 2
+
+    def snap(self, coord: Coord, fine: bool = False) -> str:
+        """Rounds a coordinate to the cache grid (or the finer one)"""
+        lat, lng = coord
+        precision = self.precision + self.fine_precision if fine else self.precision
+        return f"{lat:.{precision}f},{lng:.{precision}f}"
+
+    def time_bucket(self, mode: str, now: float = None) -> str:
+        if mode not in TIME_DEPENDENT_MODES:
+            return "any"
+        local = time.localtime(now)
+        return str((local.tm_hour * 60 + local.tm_min) // self.bucket_minutes)
+
+    def key(self, origin: Coord, destination: Coord, mode: str, now: float = None, fine: bool = False) -> str:
+        """Cache key of a cell; fine snaps the destination to the finer grid"""
+        return f"{mode}|{self.time_bucket(mode, now)}|{self.snap(origin)}|{self.snap(destination, fine)}"
+
+
+travel_time_cache = TravelTimeCache(
+    precision=int(os.environ.get("TRAVEL_TIME_CACHE_PRECISION", 3)),
+    ttl=float(os.environ.get("TRAVEL_TIME_CACHE_TTL", 7 * 24 * 3600)),
+    bucket_minutes=int(os.environ.get("TRAVEL_TIME_CACHE_BUCKET_MINUTES", 60)),
+)
+
+
+def unique_with_index(values: List[Coord]) -> Tuple[List[Coord], List[int]]:
+    """
+    Removes duplicates from values while keeping their order.
+
+    Returns the unique values and, for each original value, its position in the unique list
+    """
+    positions = {}
+    unique = []
+    index = []
+    for value in values:
+        if value not in positions:
+            positions[value] = len(unique)
+            unique.append(value)
+        index.append(positions[value])
+    return unique, index
+
+
+def plan_tiles(num_origins: int, num_destinations: int, max_origins: int = MAX_ORIGINS,
+               max_destinations: int = MAX_DESTINATIONS,
+               max_elements: int = MAX_ELEMENTS) -> List[Tuple[range, range]]:
+    """
+    Splits a num_origins x num_destinations grid into tiles that each fit in one
+    Distance Matrix request.
+
+    Returns a list of (origin indexes, destination indexes) ranges
+    """
+    if num_origins == 0 or num_destinations == 0:
+        return []
+
+    # Spread destinations evenly over as few columns as possible, then fit as many
+    # origins per tile as the element limit allows
+    max_destinations = min(max_destinations, max_elements)
+    destination_columns = math.ceil(num_destinations / max_destinations)
+    destinations_per_tile = math.ceil(num_destinations / destination_columns)
+
+    max_origins = max(1, min(max_origins, max_elements // destinations_per_tile))
+    origin_rows = math.ceil(num_origins / max_origins)
+    origins_per_tile = math.ceil(num_origins / origin_rows)
+
+    tiles = []
+    for origin_start in range(0, num_origins, origins_per_tile):
+        for destination_start in range(0, num_destinations, destinations_per_tile):
+            tiles.append((
+                range(origin_start, min(origin_start + origins_per_tile, num_origins)),
+                range(destination_start, min(destination_start + destinations_per_tile, num_destinations)),
+            ))
+    return tiles
+
+
+def _request_tile(client, origins: List[Coord], destinations: List[Coord], mode: str) -> List[List[Optional[int]]]:
+    """
+    Makes one Distance Matrix request and returns its durations.
+
+    Cells with no route (ZERO_RESULTS) are NO_ROUTE; cells with any other non-OK status
+    (NOT_FOUND, transient failures) are None, so they are not cached and get asked for again.
+    """
+    matrix = client.distance_matrix(origins=[str(origin) for origin in origins],
+                                    destinations=[str(destination) for destination in destinations],
+                                    mode=mode)
+    durations = []
+    statuses = {}
+    for row in matrix['rows']:
+        durations.append([element['duration']['value'] if element['status'] == 'OK'
+                          else NO_ROUTE if element['status'] == 'ZERO_RESULTS' else None
+                          for element in row['elements']])
+        for element in row['elements']:
+            statuses[element['status']] = statuses.get(element['status'], 0) + 1
+    for status, count in statuses.items():
+        metrics.maps_elements.inc(count, mode=mode, status=status)
+    return durations
+
+
+def pack_tiles(tiles: List[Tuple[List[Coord], List[Coord]]], max_origins: int = MAX_ORIGINS,
+               max_destinations: int = MAX_DESTINATIONS,
+               max_elements: int = MAX_ELEMENTS) -> List[Tuple[List[Coord], List[Coord]]]:
+    """
+    Packs tiles of one mode into as few requests as the API limits allow (first fit, largest
+    tiles first). A request asks for every origin against every destination of its tiles, so
+    packing small tiles together trades a few unneeded elements for fewer requests.
+
+    Returns a list of (origins, destinations) requests
+    """
+    requests = []  # [(origins, destinations)]
+    for origins, destinations in sorted(tiles, key=lambda tile: len(tile[0]) * len(tile[1]), reverse=True):
+        for request_origins, request_destinations in requests:
+            new_origins = [origin for origin in origins if origin not in request_origins]
+            new_destinations = [destination for destination in destinations if destination not in request_destinations]
+            num_origins = len(request_origins) + len(new_origins)
+            num_destinations = len(request_destinations) + len(new_destinations)
+            if (num_origins <= max_origins and num_destinations <= max_destinations
+                    and num_origins * num_destinations <= max_elements):
+                request_origins.extend(new_origins)
+                request_destinations.extend(new_destinations)
+                break
+        else:
+            requests.append((list(origins), list(destinations)))
+    return requests
+
+
+def positions_of(index: List[int]) -> List[List[int]]:
+    """Inverse of unique_with_index's index: for each unique value, its positions in the original list"""
+    positions = [[] for _ in range(max(index, default=-1) + 1)]
+    for position, unique_number in enumerate(index):
+        positions[unique_number].append(position)
+    return positions
+
+
+def get_travel_time_matrices(client, jobs: List[MatrixJob], max_workers: int = None,
+                             cache: Optional[TravelTimeCache] = travel_time_cache,
+                             stats: dict = None,
+                             on_tile: Callable[[int, List[Tuple[int, int, Optional[int]]]], None] = None
+                             ) -> List[List[List[Optional[int]]]]:
+    """
+    Computes several travel time matrices (e.g. one per transport mode) at once.
+
+    Each job's origins and destinations are deduplicated and cells already in the
+    cache are filled in without a request (destinations that share a cache grid cell with
+    another of the job's destinations are keyed on the finer grid, so they don't all get the
+    same cached time), as are cells an earlier job in the same call
+    also needs (e.g. a person or place shared by two groups). The remaining cells of every
+    job with the same mode are planned together: origins missing the same destinations are
+    split into tiles that respect the API limits, small tiles are packed into shared requests
+    (see pack_tiles), and every request is made concurrently (at most max_workers at a time,
+    MATRIX_WORKERS by default).
+
+    Args:
+        client: googlemaps.Client used to make the requests
+        jobs: List of (origins, destinations, mode)
+        max_workers: Maximum number of requests in flight
+        cache: Cell cache to read and fill, or None to always ask the API
+        stats: Optional dict that is filled with element and request counts
+        on_tile: Optional callback, called from the worker thread as each tile arrives with the
+            job number and a list of (origin position, destination position, seconds or None)
+            cells in the job's original (not deduplicated) order. Cells shared with an earlier
+            job are only reported for that job.
+
+    Returns:
+        One matrix per job, indexed [origin][destination], holding the travel time in
+        seconds or None when no route was found or the tile's request failed
+    """
+    max_workers = MATRIX_WORKERS if max_workers is None else max_workers
+    now = time.time()
+
+    deduplicated = []  # [(unique origins, origin index, unique destinations, destination index)]
+    unique_matrices = []  # Travel times over the unique values, filled from the cache then the API
+    needed = {}  # {mode: {origin: [destinations still needed]}} over every job with that mode
+    claimed = {}  # {(origin, destination, mode): (job number, origin number, destination number) requesting it}
+    shared = []  # [(job number, origin number, destination number, cell it copies from another job)]
+    crowded_by_job = []  # Per job, whether each unique destination shares its cache grid cell
+    elements_total = 0
+    elements_cached = 0
+    for job_number, (origins, destinations, mode) in enumerate(jobs):
+        unique_origins, origin_index = unique_with_index(origins)
+        unique_destinations, destination_index = unique_with_index(destinations)
+        deduplicated.append((unique_origins, origin_index, unique_destinations, destination_index))
+        matrix = [[None] * len(unique_destinations) for _ in unique_origins]
+        unique_matrices.append(matrix)
+        elements_total += len(origins) * len(destinations)
+
+        # Work out which cells are still missing for each origin
+        cached = {}
+        if cache is not None:
+            cells = Counter(cache.snap(destination) for destination in unique_destinations)
+            crowded = [cells[cache.snap(destination)] > 1 for destination in unique_destinations]
+            crowded_by_job.append(crowded)
+            keys = {(i, j): cache.key(origin, destination, mode, now, fine=crowded[j])
+                    for i, origin in enumerate(unique_origins)
+                    for j, destination in enumerate(unique_destinations)}
+            cached = cache.store.get_many(list(keys.values()))
+        for i, origin in enumerate(unique_origins):
+            missing_destinations = []
+            for j, destination in enumerate(unique_destinations):
+                value = cached.get(keys[(i, j)]) if cache is not None else None
+                if value is not None:
+                    matrix[i][j] = None if value == NO_ROUTE else value
+                    elements_cached += 1
+                elif (origin, destination, mode) in claimed:
+                    shared.append((job_number, i, j, claimed[(origin, destination, mode)]))
+                else:
+                    claimed[(origin, destination, mode)] = (job_number, i, j)
+                    missing_destinations.append(destination)
+            if missing_destinations:
+                needed.setdefault(mode, {}).setdefault(origin, []).extend(missing_destinations)
+
+    # Origins missing the same destinations (in any job of the mode) form one sub-grid, tiled
+    # like a full matrix, and the tiles of each mode are packed into as few requests as possible
+    tasks = []  # [(mode, origins, destinations)]
+    for mode, origin_destinations in needed.items():
+        missing = {}  # {tuple of missing destinations: [origins]}
+        for origin, missing_destinations in origin_destinations.items():
+            missing.setdefault(tuple(missing_destinations), []).append(origin)
+        tiles = []
+        for missing_destinations, missing_origins in missing.items():
+            for origin_range, destination_range in plan_tiles(len(missing_origins), len(missing_destinations)):
+                tiles.append(([missing_origins[i] for i in origin_range],
+                              [missing_destinations[j] for j in destination_range]))
+        tasks.extend((mode, origins, destinations) for origins, destinations in pack_tiles(tiles))
+
+    if on_tile is not None:
+        positions = [(positions_of(origin_index), positions_of(destination_index))
+                     for _, origin_index, _, destination_index in deduplicated]
+
+    def claimed_cells(task, durations) -> Dict[int, List[Tuple[int, int, Optional[int]]]]:
+        """A request's cells that a job asked for, as {job number: [(origin number, destination number, value)]}"""
+        mode, origins, destinations = task
+        cells = {}
+        for row, origin in zip(durations, origins):
+            for value, destination in zip(row, destinations):
+                owner = claimed.get((origin, destination, mode))
+                if owner is not None:  # Packed requests also return cells nobody needs
+                    cells.setdefault(owner[0], []).append((owner[1], owner[2], value))
+        return cells
+
+    def run(task):
+        mode, origins, destinations = task
+        try:
+            durations = _request_tile(client, origins, destinations, mode)
+        except Exception as e:
+            print(f"Error in distance matrix call for mode {mode}: {e}")
+            return None
+
+        if on_tile is not None:
+            for job_number, cells in claimed_cells(task, durations).items():
+                origin_positions, destination_positions = positions[job_number]
+                on_tile(job_number, [(origin, destination, None if value == NO_ROUTE else value)
+                                     for i, j, value in cells
+                                     for origin in origin_positions[i]
+                                     for destination in destination_positions[j]])
+        return durations
+
+    if tasks:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+            tile_results = list(executor.map(run, tasks))
+    else:
+        tile_results = []
+
+    # Stitch the tiles back into the matrices and remember the new cells
+    elements_requested = 0
+    new_cells = {}
+    for task, durations in zip(tasks, tile_results):
+        mode, origins, destinations = task
+        elements_requested += len(origins) * len(destinations)
+        if durations is None:
+            continue
+        for job_number, cells in claimed_cells(task, durations).items():
+            unique_origins, _, unique_destinations, _ = deduplicated[job_number]
+            matrix = unique_matrices[job_number]
+            for i, j, value in cells:
+                matrix[i][j] = None if value == NO_ROUTE else value
+                if cache is not None and value is not None:
+                    key = cache.key(unique_origins[i], unique_destinations[j], mode, now,
+                                    fine=crowded_by_job[job_number][j])
+                    new_cells[key] = value
+    if cache is not None:
+        cache.store.set_many(new_cells)
+    for job_number, i, j, (source_job, source_i, source_j) in shared:
+        unique_matrices[job_number][i][j] = unique_matrices[source_job][source_i][source_j]
+
+    if stats is not None:
+        stats.update({
+            "elements_total": elements_total,
+            "elements_cached": elements_cached,
+            "elements_requested": elements_requested,
+            "elements_saved": elements_total - elements_requested,
+            "requests": len(tasks),
+        })
+
+    # Expand back to the original (possibly duplicated) origins and destinations
+    results = []
+    for matrix, (_, origin_index, _, destination_index) in zip(unique_matrices, deduplicated):
+        results.append([[matrix[i][j] for j in destination_index] for i in origin_index])
+    return results
+
+
+def get_travel_time_matrix(client, origins: List[Coord], destinations: List[Coord], mode: str,
+                           max_workers: int = None,
+                           cache: Optional[TravelTimeCache] = travel_time_cache) -> List[List[Optional[int]]]:
+    """Computes a single travel time matrix, see get_travel_time_matrices"""
+    return get_travel_time_matrices(client, [(origins, destinations, mode)], max_workers, cache)[0]
@@ -0,0 +1,23 @@
+import sqlite3
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Created without an app; app.create_app binds it with db.init_app
+db = SQLAlchemy()
+
+
+@event.listens_for(Engine, "connect")
+def configure_sqlite(dbapi_connection, connection_record):
+    """
+    WAL mode for SQLite databases, like the caches (see cache.py): any number of workers can read
+    stored meetings while one writes, and a writer waits for the lock instead of failing at once
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
@@ -0,0 +1,98 @@
+import math
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class Coord(NamedTuple):
+    """
+    A latitude/longitude pair in degrees.
+
+    Coordinates travel through the pipeline as Coords; they are only formatted
+    as "lat,lng" strings (str(coord)) when handed to a Google client.
+    """
+    lat: float
+    lng: float
+
+    @classmethod
+    def parse(cls, value: Union[str, Sequence[float]]) -> "Coord":
+        """Builds a Coord from a "lat,lng" string or a (lat, lng) pair"""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, str):
+            lat, lng = value.split(',')
+            return cls(float(lat), float(lng))
+        lat, lng = value
+        return cls(float(lat), float(lng))
+
+    def __str__(self) -> str:
+        return f"{self.lat},{self.lng}"
+
+
+EARTH_RADIUS_METERS = 6371008.8
+
+
+def haversine_matrix(origins: Sequence[Coord], destinations: Sequence[Coord]) -> np.ndarray:
+    """
+    Great-circle distances in meters between every origin and every destination,
+    as an origins x destinations array
+    """
+    origins = np.radians(np.asarray(origins, dtype=np.float64).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=np.float64).reshape(-1, 2))
+    lat_a, lng_a = origins[:, 0:1], origins[:, 1:2]
+    lat_b, lng_b = destinations[:, 0], destinations[:, 1]
+
+    a = (np.sin((lat_b - lat_a) / 2) ** 2
+         + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
+
+def sunflower_offsets(num_points: int, radius: float) -> List[Tuple[float, float]]:
+    """
+    Evenly spread (dlat, dlng) offsets covering a disc of the given radius (in degrees),
+    laid out as a Fibonacci/sunflower spiral.
+
+    Unlike random sampling the layout is the same every time, so the same group
+    produces the same searches, and points never bunch up.
+    """
+    offsets = []
+    for i in range(num_points):
+        distance = radius * math.sqrt((i + 0.5) / num_points)
+        angle = i * GOLDEN_ANGLE
+        offsets.append((distance * math.cos(angle), distance * math.sin(angle)))
+    return offsets
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(coord: Coord, precision: int = 7) -> str:
+    """
+    Encodes a coordinate as a geohash of `precision` characters
+    (6 is about 1.2km x 0.6km, 7 about 150m x 150m)
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate between longitude and latitude, starting with longitude
+    while len(chars) < precision:
+        interval, target = (lng_range, coord.lng) if even else (lat_range, coord.lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if target >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
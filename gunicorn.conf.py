@@ -0,0 +1,32 @@
+# Gunicorn loads this file automatically from the working directory (see Procfile)
+import os
+import threading
+
+# PRELOAD_APP=1 (or `gunicorn --preload`) imports the app and the search pipeline once in the
+# master and forks the workers from it, so they start instantly and share its memory
+preload_app = os.environ.get("PRELOAD_APP", "0") == "1"
+
+
+def when_ready(server):
+    """Runs in the master once it's listening, before the first workers are forked"""
+    if server.cfg.preload_app:
+        from app import load_pipeline
+
+        loaded = load_pipeline()
+        server.log.info(f"Preloaded the search pipeline and {loaded} geocoded addresses")
+
+
+def post_fork(server, worker):
+    """Runs in each worker once it has been forked"""
+    if server.cfg.preload_app:
+        return  # Inherited from the master
+
+    def warm_up():
+        from app import load_pipeline
+
+        loaded = load_pipeline()
+        server.log.info(f"Worker {worker.pid}: loaded the search pipeline and {loaded} geocoded addresses")
+
+    # In the background, so the worker starts serving straight away; a search that comes in
+    # first just waits for the import to finish
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
@@ -1,22 +1,18 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 import os
-import googlemaps
 from typing import Any, Dict, List
 import json
-from geopy.distance import distance
 import math, random
 import urllib.parse
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///meetingpoints.db'
-db = SQLAlchemy(app)
+from extensions import db
+from geometry import sunflower_offsets
+from transport import LazyClient
 
 # APIKEY
 GOOG_API_KEY = os.environ.get("GOOG_API_KEY")
 
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=GOOG_API_KEY)
+# Google Maps client, built on first use (shares this worker's pooled transport, see transport.py)
+gmaps = LazyClient()
 
 
 # Models
@@ -26,6 +22,9 @@ class Meeting(db.Model):
     both forms of transport, as well as an oprional meeting point and place type
     both forms of transport, as well as an oprional meeting point and place type
     """
+    # refactored.Meeting owns the "meeting" table now that both share one database
+    __tablename__ = "legacy_meeting"
+
     id = db.Column(db.Integer, primary_key=True)
     location_a = db.Column(db.String(100))
     location_b = db.Column(db.String(100))
@@ -296,7 +295,7 @@ def parse_places(json_data: str) -> List[Place]:
     return places
 
 
-def get_midpoints_around_midpoint(coord_a, coord_b, num_points=10, radius_ratio=0.1):
+def get_midpoints_around_midpoint(coord_a, coord_b, num_points=10, radius_ratio=0.1, layout="sunflower"):
     """
     Returns num_points (10 as default) points within a radius around the midpoint
     between coord_a and coord_b, with the radius being a percentage of the direct
@@ -308,6 +307,8 @@ def get_midpoints_around_midpoint(coord_a, coord_b, num_points=10, radius_ratio=
         coord_a, coord_b (str): The locations you wish to find the midpoints from.
         num_points (int): The number of points to generate.
         radius_ratio (float): The radius as a percentage of the direct distance between the points.
+        layout (str): "sunflower" spreads the points evenly and always gives the same points,
+        "random" samples them.
 
     Returns:
         midpoints (List[str]): A list of midpoints each consisting of a
@@ -330,6 +331,11 @@ def get_midpoints_around_midpoint(coord_a, coord_b, num_points=10, radius_ratio=
     
     midpoints = []
     
+    if layout == "sunflower":
+        for dlat, dlng in sunflower_offsets(num_points, radius):
+            midpoints.append(f"{mid_lat + dlat},{mid_lng + dlng}")
+        return midpoints
+    
     for _ in range(num_points):
         # Random angle in radians
         angle = random.uniform(0, 2 * math.pi)
@@ -0,0 +1,137 @@
+"""
+Import-time benchmark: how long a fresh interpreter takes to import the app (what every gunicorn
+worker pays before it can serve a request, unless the app is preloaded) and the search pipeline.
+
+Each target is imported in its own subprocess, several times, and the median is reported along
+with the slowest modules from `python -X importtime`.
+
+    python import_benchmark.py
+    python import_benchmark.py --runs 10 --top 15 --json imports.json
+    python import_benchmark.py --baseline imports.json        # exits with 1 if an import got slower
+    python import_benchmark.py --baseline imports.json --tolerance 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# What a worker imports at boot, then what the first search loads (see app.load_pipeline)
+DEFAULT_TARGETS = ("app", "app:load_pipeline")
+
+# Imports (and, for "module:function", calls) the target and prints the seconds it took
+# (__import__ rather than importlib.import_module, which -X importtime doesn't report)
+TIMER = """
+import sys, time
+module, _, function = sys.argv[1].partition(":")
+start = time.perf_counter()
+__import__(module)
+loaded = sys.modules[module]
+if function:
+    getattr(loaded, function)()
+print(time.perf_counter() - start)
+"""
+
+
+def child_env() -> dict:
+    """Offline settings, so no import can touch the network or the real caches"""
+    env = dict(os.environ)
+    env.setdefault("MAPS_BACKEND", "replay")
+    env.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="meet-imports-"), "cache.db"))
+    return env
+
+
+def time_import(target: str, env: dict) -> float:
+    output = subprocess.run([sys.executable, "-c", TIMER, target], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_modules(target: str, env: dict, top: int) -> list:
+    """(module, cumulative seconds) for the imports that took longest, from -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", TIMER, target], env=env, check=True,
+                            capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is shown by two spaces per level; keep the target's own imports (and the
+        # interpreter's, e.g. site), not their dependencies or the target itself
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth > 1 or name.strip() == target.partition(":")[0]:
+            continue
+        modules.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+
+
+def run_benchmarks(targets, runs: int, top: int) -> list:
+    env = child_env()
+    results = []
+    for target in targets:
+        times = [time_import(target, env) for _ in range(runs)]
+        results.append({
+            "target": target,
+            "runs": runs,
+            "median": statistics.median(times),
+            "min": min(times),
+            "max": max(times),
+            "slowest_modules": slowest_modules(target, env, top),
+        })
+    return results
+
+
+def print_report(results: list):
+    for result in results:
+        print(f"{result['target']}: median {result['median'] * 1000:.0f}ms "
+              f"(min {result['min'] * 1000:.0f}ms, max {result['max'] * 1000:.0f}ms, {result['runs']} runs)")
+        for module, seconds in result["slowest_modules"]:
+            print(f"  {seconds * 1000:>8.1f}ms  {module}")
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Targets whose median import time grew by more than tolerance times the baseline"""
+    previous = {r["target"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result["target"])
+        if old and result["median"] > old["median"] * tolerance:
+            regressions.append(f"{result['target']}: {old['median'] * 1000:.0f}ms -> {result['median'] * 1000:.0f}ms")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure how long the app takes to import")
+    parser.add_argument("targets", nargs="*", default=DEFAULT_TARGETS,
+                        help="Modules to import, or module:function to import and call")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per target")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against results written earlier with --json")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Fail when a median is this many times the baseline's")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.targets, args.runs, args.top)
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
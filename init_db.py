@@ -1,4 +1,6 @@
-from app import app, db
+from app import app
+from extensions import db
+import refactored  # registers the models
 
 with app.app_context():
-    db.create_all()
\ No newline at end of file
+    db.create_all()
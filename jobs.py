@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+from cache import PersistentCache
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", 32))
+# Seconds finished jobs are kept for polling
+JOB_TTL = float(os.environ.get("JOB_TTL", 3600))
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while JOB_QUEUE_DEPTH jobs are already waiting or running"""
+
+
+class JobQueue:
+    """
+    Runs slow work (e.g. get_all_locations_for_group) on a local thread pool so a web
+    worker can return a job id straight away.
+
+    Job records (status, result, timings) are kept in the shared SQLite cache, so any
+    gunicorn worker can answer a poll, not just the one running the job. Results must
+    be JSON serialisable.
+
+    The job's pipeline stage durations (see metrics.stage) are collected on the job's own
+    thread, stored in the record as timings and logged as one JSON line when it finishes.
+    """
+    def __init__(self, workers: int = JOB_WORKERS, max_depth: int = JOB_QUEUE_DEPTH, ttl: float = JOB_TTL):
+        self.workers = workers
+        self.max_depth = max_depth
+        # No in-process tier: another worker may update the record at any time
+        self.store = PersistentCache("jobs", max_entries=10000, ttl=ttl, memory_entries=0)
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads don't survive a fork, so each worker process starts its own pool
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            self._pid = os.getpid()
+            self._pending = 0
+        return self._executor
+
+    def submit(self, fn: Callable[..., Any], *args, meta: Dict[str, Any] = None, **kwargs) -> str:
+        """
+        Queues fn(*args, **kwargs) and returns the job id. meta is stored with the job
+        (e.g. the form data needed to render its result). Raises QueueFull if the queue is full.
+        """
+        with self._lock:
+            executor = self._get_executor()
+            if self._pending >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(f"Too many searches in progress ({self.max_depth}), please try again shortly")
+            self._pending += 1
+            self.submitted += 1
+
+        job_id = uuid.uuid4().hex
+        record = {"id": job_id, "status": "queued", "queued_at": time.time(), "meta": meta or {},
+                  "result": None, "error": None, "wait_time": None, "run_time": None}
+        self.store.set(job_id, record)
+        executor.submit(self._run, record, fn, args, kwargs)
+        return job_id
+
+    def _run(self, record: Dict[str, Any], fn: Callable[..., Any], args: tuple, kwargs: dict):
+        started = time.time()
+        record.update(status="running", started_at=started, wait_time=started - record["queued_at"])
+        try:
+            self.store.set(record["id"], record)
+            # Pool threads don't inherit the submitting request's context, so collect the job's own
+            timings = metrics.start_request_timings()
+            try:
+                record["result"] = fn(*args, **kwargs)
+                record["status"] = "done"
+            except Exception as e:
+                print(f"Job {record['id']} failed: {e}")
+                record["error"] = str(e)
+                record["status"] = "failed"
+            finally:
+                metrics.stop_request_timings()
+            finished = time.time()
+            record.update(finished_at=finished, run_time=finished - started, timings=timings)
+            print(json.dumps({
+                "event": "job",
+                "id": record["id"],
+                "status": record["status"],
+                "wait_ms": round(record["wait_time"] * 1000, 1),
+                "timings_ms": metrics.timings_ms(dict(timings, total=record["run_time"])),
+            }))
+            try:
+                self.store.set(record["id"], record)
+            except (TypeError, ValueError) as e:
+                # The result isn't JSON serialisable; record the job as failed instead
+                print(f"Job {record['id']} result could not be stored: {e}")
+                record.update(result=None, error=f"Could not store the result: {e}", status="failed")
+                self.store.set(record["id"], record)
+        finally:
+            # Whatever happens, the job no longer holds a queue slot
+            with self._lock:
+                self._pending -= 1
+                self.total_wait_time += record["wait_time"]
+                self.total_run_time += record["run_time"] or 0.0
+                if record["status"] == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's record, or None if it doesn't exist (or has expired)"""
+        return self.store.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Polls until the job has finished or timeout seconds have passed, then returns its record"""
+        deadline = time.time() + timeout
+        record = self.get(job_id)
+        while record is not None and record["status"] in ("queued", "running") and time.time() < deadline:
+            time.sleep(0.1)
+            record = self.get(job_id)
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for this worker process; wait and run times are in seconds"""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "max_depth": self.max_depth,
+                "pending": self._pending,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "total_wait_time": self.total_wait_time,
+                "total_run_time": self.total_run_time,
+                "mean_wait_time": self.total_wait_time / finished if finished else 0.0,
+                "mean_run_time": self.total_run_time / finished if finished else 0.0,
+            }
+
+
+job_queue = JobQueue()
+
+
+def collect_job_metrics():
+    stats = job_queue.stats()
+    yield ("jobs_pending", "gauge", "Queued or running jobs", [({}, stats["pending"])])
+    yield ("jobs_total", "counter", "Jobs by outcome",
+           [({"status": status}, stats[status]) for status in ("submitted", "rejected", "completed", "failed")])
+    yield ("jobs_wait_seconds_total", "counter", "Time finished jobs spent queued", [({}, stats["total_wait_time"])])
+    yield ("jobs_run_seconds_total", "counter", "Time finished jobs spent running", [({}, stats["total_run_time"])])
+
+
+metrics.registry.add_collector(collect_job_metrics)
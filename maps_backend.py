@@ -0,0 +1,225 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+from geometry import Coord, EARTH_RADIUS_METERS
+
+# Where recorded Maps responses are kept (one JSON file per distinct request)
+MAPS_FIXTURE_DIR = os.environ.get(
+    "MAPS_FIXTURE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "maps"),
+)
+
+# The Google Maps client methods the pipeline uses, with their leading positional parameters
+MAPS_METHODS = {
+    "geocode": ("address",),
+    "places_nearby": ("location", "radius"),
+    "distance_matrix": ("origins", "destinations", "mode"),
+}
+
+# Straight-line speeds (m/s) and fixed overheads (s) the synthetic Distance Matrix uses per mode
+SYNTHETIC_SPEEDS = {"walking": 1.4, "bicycling": 4.5, "driving": 11.0, "transit": 7.0}
+SYNTHETIC_OVERHEADS = {"walking": 0, "bicycling": 60, "driving": 180, "transit": 420}
+
+# Synthetic addresses are spread over this area (roughly greater Sydney)
+SYNTHETIC_CENTER = Coord(-33.8688, 151.2093)
+SYNTHETIC_SPREAD = 0.15  # degrees
+# Addresses in the same locality (whatever follows the first comma) land this close to its center
+SYNTHETIC_LOCALITY_SPREAD = 0.005  # degrees
+
+
+def normalize_request(method: str, args: tuple, kwargs: dict) -> Dict[str, Any]:
+    """A call's parameters by name, with locations as strings, however the call was written"""
+    params = dict(zip(MAPS_METHODS[method], args), **kwargs)
+    for name in ("address", "location"):
+        if params.get(name) is not None:
+            params[name] = str(params[name])
+    for name in ("origins", "destinations"):
+        if params.get(name) is not None:
+            params[name] = [str(location) for location in params[name]]
+    return params
+
+
+def fixture_key(method: str, params: Dict[str, Any]) -> str:
+    """Stable name for a request, so the same call made again maps to the same fixture file"""
+    request = json.dumps([method, params], sort_keys=True, default=str)
+    return hashlib.sha256(request.encode()).hexdigest()[:32]
+
+
+def fixture_path(fixture_dir: str, method: str, params: Dict[str, Any]) -> str:
+    return os.path.join(fixture_dir, method, fixture_key(method, params) + ".json")
+
+
+def _unit(text: str, salt: str = "") -> float:
+    """A deterministic number in [0, 1) for text"""
+    return int(hashlib.md5(f"{salt}{text}".encode()).hexdigest()[:12], 16) / float(1 << 48)
+
+
+def _parse_location(location: Any) -> Coord:
+    """A Coord for a "lat,lng" string, Coord or address (addresses are synthetically geocoded)"""
+    if isinstance(location, (tuple, list)) and len(location) == 2:
+        return Coord(float(location[0]), float(location[1]))
+    text = str(location)
+    try:
+        return Coord.parse(text)
+    except (TypeError, ValueError):
+        return synthetic_geocode_point(text)
+
+
+def synthetic_geocode_point(address: str) -> Coord:
+    key = " ".join(address.lower().split())
+    locality = key.partition(",")[2].strip()
+    if not locality:
+        return Coord(SYNTHETIC_CENTER.lat + (_unit(key, "lat") - 0.5) * 2 * SYNTHETIC_SPREAD,
+                     SYNTHETIC_CENTER.lng + (_unit(key, "lng") - 0.5) * 2 * SYNTHETIC_SPREAD)
+    center = synthetic_geocode_point(locality)
+    return Coord(center.lat + (_unit(key, "lat") - 0.5) * 2 * SYNTHETIC_LOCALITY_SPREAD,
+                 center.lng + (_unit(key, "lng") - 0.5) * 2 * SYNTHETIC_LOCALITY_SPREAD)
+
+
+def _distance(a: Coord, b: Coord) -> float:
+    lat_a, lat_b = math.radians(a.lat), math.radians(b.lat)
+    d_lat, d_lng = lat_b - lat_a, math.radians(b.lng - a.lng)
+    h = math.sin(d_lat / 2) ** 2 + math.cos(lat_a) * math.cos(lat_b) * math.sin(d_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(h)))
+
+
+class RecordingClient:
+    """
+    Wraps a live googlemaps.Client and saves every response under fixture_dir,
+    so the same searches can later be replayed offline with ReplayClient.
+    """
+    def __init__(self, client, fixture_dir: str = MAPS_FIXTURE_DIR):
+        self._client = client
+        self.fixture_dir = fixture_dir
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in MAPS_METHODS:
+            return attribute
+
+        def call(*args, **kwargs):
+            response = attribute(*args, **kwargs)
+            params = normalize_request(name, args, kwargs)
+            path = fixture_path(self.fixture_dir, name, params)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump({"method": name, "params": params, "response": response}, f, default=str, indent=1)
+            return response
+        return call
+
+
+class ReplayClient:
+    """
+    Offline stand-in for googlemaps.Client.
+
+    Serves responses recorded by RecordingClient and, for requests that weren't recorded,
+    deterministic synthetic ones (unless missing="error"). Every call waits latency seconds
+    plus element_latency per Distance Matrix element, to mimic the real API. Call and element
+    counts are kept for benchmarks.
+    """
+    def __init__(self, fixture_dir: str = MAPS_FIXTURE_DIR, latency: float = 0.0, element_latency: float = 0.0,
+                 missing: str = "synthetic"):
+        if missing not in ("synthetic", "error"):
+            raise ValueError(f"Unknown missing fixture behaviour: {missing}")
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.element_latency = element_latency
+        self.missing = missing
+
+        self.calls = {}  # {method: count}
+        self.elements = 0
+        self.replayed = 0
+        self.synthesized = 0
+        self._lock = threading.Lock()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls = {}
+            self.elements = 0
+            self.replayed = 0
+            self.synthesized = 0
+
+    def _respond(self, method: str, params: Dict[str, Any], synthesize) -> Any:
+        path = fixture_path(self.fixture_dir, method, params)
+        response = None
+        if os.path.exists(path):
+            with open(path) as f:
+                response = json.load(f)["response"]
+        elif self.missing == "error":
+            raise KeyError(f"No recorded {method} response for {params}")
+
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if response is None:
+                self.synthesized += 1
+            else:
+                self.replayed += 1
+        return response if response is not None else synthesize()
+
+    def geocode(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        params = normalize_request("geocode", args, kwargs)
+        address = params.get("address", "")
+
+        def synthesize():
+            point = synthetic_geocode_point(address)
+            return [{"formatted_address": address, "geometry": {"location": {"lat": point.lat, "lng": point.lng}}}]
+        response = self._respond("geocode", params, synthesize)
+        time.sleep(self.latency)
+        return response
+
+    def places_nearby(self, *args, **kwargs) -> Dict[str, Any]:
+        params = normalize_request("places_nearby", args, kwargs)
+        radius, type = params.get("radius"), params.get("type")
+
+        def synthesize():
+            center = _parse_location(params.get("location"))
+            seed = f"{center.lat:.3f},{center.lng:.3f}|{type}"
+            # Denser results for bigger radii, up to Google's page size of 20
+            count = min(20, 4 + int((radius or 1500) / 250))
+            meters_per_degree = EARTH_RADIUS_METERS * math.pi / 180
+            results = []
+            for i in range(count):
+                angle = _unit(seed, f"angle{i}") * 2 * math.pi
+                distance = math.sqrt(_unit(seed, f"distance{i}")) * (radius or 1500)
+                lat = center.lat + distance * math.cos(angle) / meters_per_degree
+                lng = center.lng + distance * math.sin(angle) / (meters_per_degree * math.cos(math.radians(center.lat)))
+                name = f"Synthetic {type} {int(_unit(seed, f'name{i}') * 1e6)}"
+                results.append({
+                    "name": name,
+                    "vicinity": f"{i + 1} Synthetic St",
+                    "place_id": hashlib.md5(f"{name}{lat:.5f}{lng:.5f}".encode()).hexdigest(),
+                    "rating": round(3 + 2 * _unit(seed, f"rating{i}"), 1),
+                    "user_ratings_total": int(1000 * _unit(seed, f"ratings{i}")),
+                    "geometry": {"location": {"lat": round(lat, 7), "lng": round(lng, 7)}},
+                })
+            return {"results": results, "status": "OK" if results else "ZERO_RESULTS"}
+        response = self._respond("places_nearby", params, synthesize)
+        time.sleep(self.latency)
+        return response
+
+    def distance_matrix(self, *args, **kwargs) -> Dict[str, Any]:
+        params = normalize_request("distance_matrix", args, kwargs)
+        origins, destinations = params["origins"], params["destinations"]
+        mode = params.get("mode") or "driving"
+
+        def synthesize():
+            speed = SYNTHETIC_SPEEDS.get(mode, SYNTHETIC_SPEEDS["driving"])
+            overhead = SYNTHETIC_OVERHEADS.get(mode, 0)
+            destination_points = [_parse_location(d) for d in destinations]
+            rows = []
+            for origin in origins:
+                origin_point = _parse_location(origin)
+                rows.append({"elements": [
+                    {"status": "OK", "duration": {"value": int(_distance(origin_point, point) * 1.3 / speed) + overhead}}
+                    for point in destination_points]})
+            return {"rows": rows, "status": "OK"}
+        response = self._respond("distance_matrix", params, synthesize)
+        with self._lock:
+            self.elements += len(origins) * len(destinations)
+        time.sleep(self.latency + self.element_latency * len(origins) * len(destinations))
+        return response
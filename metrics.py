@@ -0,0 +1,393 @@
+import atexit
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets (seconds) for Maps calls and pipeline stages
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every worker publishes its metrics to this SQLite file (the cache file by default) and
+# /metrics sums them, so any worker's scrape covers them all
+METRICS_DB_PATH = os.environ.get(
+    "METRICS_DB_PATH",
+    os.environ.get("CACHE_DB_PATH",
+                   os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "cache.db")),
+)
+
+# Seconds between a worker's publishes (it also publishes whenever it answers /metrics, and on exit)
+METRICS_PUBLISH_INTERVAL = float(os.environ.get("METRICS_PUBLISH_INTERVAL", 10))
+
+# (sample name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # {label values: count}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _ensure_publisher()
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, like prometheus_client's Histogram"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # {label values: [bucket counts..., sum]}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * len(self.buckets) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+        _ensure_publisher()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the with block took"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+                samples.append((f"{self.name}_sum", labels, counts[-1]))
+                samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """
+    Metrics rendered in the Prometheus text format, summed over every worker process.
+
+    Each process publishes its own values to the metric_samples table of METRICS_DB_PATH
+    (every METRICS_PUBLISH_INTERVAL seconds, on exit and whenever it renders), and render
+    adds up every process's rows. Counters and histograms keep the rows of workers that have
+    exited, so totals don't drop when gunicorn replaces a worker; gauges only count live workers.
+
+    Collectors are callbacks run at scrape time for values that are already counted
+    elsewhere (e.g. cache stats); each returns (name, kind, documentation, [(labels, value)]).
+    Shared collectors report state every worker sees the same way (e.g. the size of a SQLite
+    table) and are rendered as this process sees them instead of summed.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or METRICS_DB_PATH
+        self._metrics = []
+        self._collectors = []  # [(collect, shared)]
+        self._process = None  # This process's key in metric_samples, see _process_key
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect: Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]],
+                      shared: bool = False):
+        self._collectors.append((collect, shared))
+
+    def _families(self, shared: bool) -> List[Tuple[str, str, str, List[Sample]]]:
+        """This process's metric families (name, kind, documentation, samples), per-process or shared ones"""
+        families = []
+        if not shared:
+            families = [(metric.name, metric.kind, metric.documentation, metric.samples()) for metric in self._metrics]
+        for collect, collector_shared in self._collectors:
+            if collector_shared != shared:
+                continue
+            try:
+                for name, kind, documentation, samples in collect():
+                    families.append((name, kind, documentation, [(name, labels, value) for labels, value in samples]))
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        return families
+
+    def _process_key(self) -> str:
+        """Unique per process, so a recycled pid doesn't overwrite an exited worker's counters"""
+        with self._lock:
+            if self._process is None or not self._process.startswith(f"{os.getpid()}-"):
+                self._process = f"{os.getpid()}-{time.time()}"
+            return self._process
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metric_samples ("
+            "process TEXT, pid INTEGER, family TEXT, kind TEXT, documentation TEXT, "
+            "sample TEXT, labels TEXT, value REAL, PRIMARY KEY (process, sample, labels))"
+        )
+        return conn
+
+    def publish(self, conn: sqlite3.Connection = None):
+        """Replaces this process's rows in metric_samples with its current values"""
+        process = self._process_key()
+        rows = [(process, os.getpid(), name, kind, documentation, sample, json.dumps(list(labels.items())), value)
+                for name, kind, documentation, samples in self._families(shared=False)
+                for sample, labels, value in samples]
+        own = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM metric_samples WHERE process = ?", (process,))
+                conn.executemany("INSERT INTO metric_samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            if own:
+                conn.close()
+
+    def _aggregate(self) -> List[Tuple[str, str, str, List[Sample]]]:
+        """Every worker's published families, summed per sample"""
+        conn = self._connect()
+        try:
+            self.publish(conn)
+            rows = conn.execute(
+                "SELECT pid, family, kind, documentation, sample, labels, value FROM metric_samples ORDER BY rowid"
+            ).fetchall()
+            alive = {pid: _alive(pid) for pid in {row[0] for row in rows}}
+            dead = [pid for pid, is_alive in alive.items() if not is_alive]
+            if dead:
+                with conn:
+                    conn.executemany("DELETE FROM metric_samples WHERE kind = 'gauge' AND pid = ?",
+                                     [(pid,) for pid in dead])
+        finally:
+            conn.close()
+
+        families = {}  # {family: (kind, documentation, {(sample, labels): value})}
+        for pid, family, kind, documentation, sample, labels, value in rows:
+            if kind == "gauge" and not alive[pid]:
+                continue
+            totals = families.setdefault(family, (kind, documentation, {}))[2]
+            totals[(sample, labels)] = totals.get((sample, labels), 0) + value
+        return [(family, kind, documentation,
+                 [(sample, dict(json.loads(labels)), value) for (sample, labels), value in totals.items()])
+                for family, (kind, documentation, totals) in families.items()]
+
+    def render(self) -> str:
+        try:
+            families = self._aggregate()
+        except sqlite3.Error as e:
+            print(f"Metrics aggregation error, serving this worker's metrics only: {e}")
+            families = self._families(shared=False)
+        by_name = {}
+        for name, kind, documentation, samples in families + self._families(shared=True):
+            by_name.setdefault(name, (kind, documentation, []))[2].extend(samples)
+
+        lines = []
+        for name, (kind, documentation, samples) in by_name.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples:
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+_publisher_pid = None
+
+
+def _ensure_publisher():
+    """Starts this process's publishing thread on its first recorded metric (again after a fork)"""
+    global _publisher_pid
+    if _publisher_pid == os.getpid():
+        return
+    with registry._lock:
+        if _publisher_pid == os.getpid():
+            return
+        _publisher_pid = os.getpid()
+    threading.Thread(target=_publish_periodically, name="metrics-publisher", daemon=True).start()
+
+
+def _publish_periodically():
+    pid = os.getpid()
+    while True:
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+        if os.getpid() != pid:
+            return
+        _publish_quietly()
+
+
+def _publish_quietly():
+    try:
+        registry.publish()
+    except sqlite3.Error as e:
+        print(f"Metrics publish error: {e}")
+
+
+@atexit.register
+def _publish_at_exit():
+    if _publisher_pid == os.getpid():
+        _publish_quietly()
+
+maps_calls = registry.register(Counter(
+    "maps_calls_total", "Google Maps API calls by call type and response status", ["call", "status"]))
+maps_call_seconds = registry.register(Histogram(
+    "maps_call_seconds", "Google Maps API call latency, including client retries", ["call"]))
+maps_elements = registry.register(Counter(
+    "maps_distance_matrix_elements_total", "Distance Matrix elements returned, by element status", ["mode", "status"]))
+stage_seconds = registry.register(Histogram(
+    "search_stage_seconds", "Time spent in each stage of the search pipeline", ["stage"]))
+searches = registry.register(Counter(
+    "searches_total", "Searches run through get_all_locations_for_group", ["status"]))
+
+
+# Stage durations (seconds) of the request being handled in this context, see start_request_timings
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Starts collecting stage durations for the current request and returns the dict they're added to"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def stop_request_timings():
+    _request_timings.set(None)
+
+
+def current_request_timings() -> Optional[Dict[str, float]]:
+    """The stage durations collected so far in this context, or None if nothing is collecting them"""
+    return _request_timings.get()
+
+
+def timings_ms(timings: Dict[str, float]) -> Dict[str, float]:
+    """Stage durations in milliseconds, for logs and JSON responses"""
+    return {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a pipeline stage: observed in search_stage_seconds and, inside a request, added to
+    that request's timings (a stage that runs more than once is summed)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Formats stage durations as a Server-Timing header value (durations in milliseconds)"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def call_status(result=None, error: Exception = None) -> str:
+    """The Maps status of a call: the body's status, or what went wrong"""
+    if error is not None:
+        if getattr(error, "status", None):
+            return str(error.status)  # googlemaps ApiError, e.g. OVER_QUERY_LIMIT
+        if getattr(error, "status_code", None):
+            return f"HTTP_{error.status_code}"
+        return type(error).__name__.upper()
+    if isinstance(result, dict):
+        return result.get("status", "OK")
+    if isinstance(result, list):
+        return "OK" if result else "ZERO_RESULTS"  # Geocoding returns just the results
+    return "OK"
+
+
+@contextmanager
+def track_call(call: str):
+    """Times one Maps call; the with block should set outcome["result"] to the response"""
+    outcome = {"result": None}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except Exception as e:
+        maps_calls.inc(call=call, status=call_status(error=e))
+        raise
+    else:
+        maps_calls.inc(call=call, status=call_status(outcome["result"]))
+    finally:
+        maps_call_seconds.observe(time.perf_counter() - start, call=call)
+
+
+class InstrumentedClient:
+    """Wraps a googlemaps.Client so every API method call is counted and timed"""
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        def call(*args, **kwargs):
+            with track_call(name) as outcome:
+                outcome["result"] = attribute(*args, **kwargs)
+                return outcome["result"]
+        return call
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,164 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+from distance_matrix import get_travel_time_matrices
+from geometry import Coord, haversine_matrix
+
+# Number of Distance Matrix probes (one destination each) the optimizer may spend per search.
+# Off by default: the probes add Distance Matrix calls and rarely beat the centroid by much
+OPTIMIZER_PROBES = int(os.environ.get("OPTIMIZER_PROBES", 0))
+
+# Stop once the modelled best point moves less than this (degrees, roughly 100m)
+MIN_MOVE = 0.001
+
+# Stop once the model expects the next probe to improve the best measured score by less than
+# this fraction of it, so searches whose centroid is already fair stop after one probe
+OPTIMIZER_TOLERANCE = float(os.environ.get("OPTIMIZER_TOLERANCE", 0.1))
+
+# Slowest effective speed (m/s) assumed when a probe comes back implausibly slow
+MIN_SPEED = 0.5
+
+
+def score_times(times: np.ndarray, objective: str) -> np.ndarray:
+    """
+    Scores travel times for one or more candidate points (last axis is people). Lower is better.
+
+    "max" is the minimax objective, "total" the sum, and "fairness" matches
+    Place.calculate_metrics (variance plus a tenth of the max time).
+    """
+    if objective == "max":
+        return times.max(axis=-1)
+    if objective == "total":
+        return times.sum(axis=-1)
+    return (times.var(axis=-1) + times.max(axis=-1) * 0.1) / 10000
+
+
+def _modelled_best_point(origins: np.ndarray, speeds: np.ndarray, overheads: np.ndarray,
+                         start: Coord, step: float, objective: str) -> Coord:
+    """
+    Pattern search for the point minimising the objective under a simple travel model:
+    time = straight-line distance / effective speed + fixed overhead, per person.
+    Runs entirely locally - no API calls.
+    """
+    directions = np.array([(np.cos(a), np.sin(a)) for a in np.linspace(0, 2 * np.pi, 8, endpoint=False)])
+    best = np.array(start, dtype=np.float64)
+    best_score = score_times(haversine_matrix([best], origins)[0] / speeds + overheads, objective)
+
+    while step > MIN_MOVE / 10:
+        candidates = best + directions * step
+        times = haversine_matrix(candidates, origins) / speeds + overheads
+        scores = score_times(times, objective)
+        i = int(np.argmin(scores))
+        if scores[i] < best_score:
+            best, best_score = candidates[i], scores[i]
+        else:
+            step /= 2
+    return Coord(float(best[0]), float(best[1]))
+
+
+def should_probe(modes: List[str], probes: int = None) -> bool:
+    """
+    Whether find_fair_meeting_point would spend any probes on a group with these transport
+    modes: only when probes are enabled and the group mixes modes (with everyone on the same
+    mode the centroid is already about as fair as it gets)
+    """
+    probes = OPTIMIZER_PROBES if probes is None else probes
+    return probes > 0 and len(modes) >= 2 and len(set(modes)) > 1
+
+
+def find_fair_meeting_point(client, origins: List[Coord], modes: List[str], start: Coord,
+                            objective: str = "fairness", probes: int = None) -> Tuple[Coord, dict]:
+    """
+    Moves the search center from start towards the point with the fairest travel times.
+
+    Each round measures everyone's real travel time to the current point with one small
+    Distance Matrix probe, fits each person's effective speed and fixed overhead from all
+    probes so far, and jumps to the best point under that model (Weiszfeld-style: the
+    model is cheap to optimise, the probes keep it honest). The best *measured* point
+    is returned, so the result is never worse than start. Probing stops early once the
+    model expects less than OPTIMIZER_TOLERANCE improvement from another probe. Groups
+    that don't mix transport modes aren't probed (see should_probe).
+
+    Args:
+        client: googlemaps.Client used for the probes
+        origins: Everyone's starting point
+        modes: Everyone's transport mode, in the same order
+        start: Where to start (usually the geographic centroid)
+        objective: "fairness", "max" or "total" (see score_times)
+        probes: Maximum number of probes, OPTIMIZER_PROBES by default
+
+    Returns:
+        The best point found and a dict of stats (probes used, elements requested, scores)
+    """
+    probes = OPTIMIZER_PROBES if probes is None else probes
+    stats = {"probes": 0, "elements": 0, "start_score": None, "best_score": None}
+    if not should_probe(modes, probes):
+        return start, stats
+
+    origin_array = np.asarray(origins, dtype=np.float64)
+    spread = float(np.max(np.abs(origin_array - np.asarray(start)))) or MIN_MOVE
+
+    mode_groups = {}  # {mode: [person index, ...]}
+    for person_idx, mode in enumerate(modes):
+        mode_groups.setdefault(mode, []).append(person_idx)
+
+    probed_points = []
+    probed_distances = []  # [people] distances per probe
+    probed_times = []  # [people] measured times per probe
+
+    point = start
+    best_point, best_score = start, None
+    for _ in range(probes):
+        jobs = [([origins[i] for i in person_indexes], [point], mode) for mode, person_indexes in mode_groups.items()]
+        matrix_stats = {}
+        matrices = get_travel_time_matrices(client, jobs, stats=matrix_stats)
+        stats["probes"] += 1
+        stats["elements"] += matrix_stats["elements_requested"]
+
+        times = np.full(len(origins), np.nan)
+        for person_indexes, matrix in zip(mode_groups.values(), matrices):
+            for person_idx, row in zip(person_indexes, matrix):
+                if row[0] is not None:
+                    times[person_idx] = row[0]
+        if np.isnan(times).any():
+            # Someone can't reach this point; stay with the best point so far
+            break
+
+        score = float(score_times(times, objective))
+        if stats["start_score"] is None:
+            stats["start_score"] = score
+        if best_score is None or score < best_score:
+            best_point, best_score = point, score
+
+        probed_points.append(point)
+        probed_distances.append(haversine_matrix([point], origin_array)[0])
+        probed_times.append(times)
+
+        # Fit time = distance / speed + overhead per person. One probe only gives a speed;
+        # with two or more a least-squares line through the probes also gives the overhead.
+        distances = np.array(probed_distances)
+        measured = np.array(probed_times)
+        if len(probed_points) == 1:
+            speeds = np.maximum(distances[0] / np.maximum(measured[0], 1.0), MIN_SPEED)
+            overheads = np.zeros(len(origins))
+        else:
+            d_mean, t_mean = distances.mean(axis=0), measured.mean(axis=0)
+            covariance = ((distances - d_mean) * (measured - t_mean)).sum(axis=0)
+            spread_d = ((distances - d_mean) ** 2).sum(axis=0)
+            slope = np.divide(covariance, spread_d, out=np.zeros(len(origins)), where=spread_d > 0)
+            slope = np.clip(slope, 1 / 60.0, 1 / MIN_SPEED)  # Between 60 m/s and MIN_SPEED
+            speeds = 1 / slope
+            overheads = np.maximum(t_mean - d_mean * slope, 0.0)
+
+        next_point = _modelled_best_point(origin_array, speeds, overheads, point, spread / 2, objective)
+        if max(abs(next_point.lat - point.lat), abs(next_point.lng - point.lng)) < MIN_MOVE:
+            break
+        expected = float(score_times(haversine_matrix([next_point], origin_array)[0] / speeds + overheads, objective))
+        if best_score - expected < OPTIMIZER_TOLERANCE * best_score:
+            break
+        point = next_point
+
+    stats["best_score"] = best_score
+    return best_point, stats
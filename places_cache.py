@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import metrics
+from cache import PersistentCache
+from geometry import Coord, geohash
+
+# Radius buckets (meters); a search is cached under the smallest bucket that covers its radius
+RADIUS_BUCKETS = (500, 1000, 1500, 2000, 3000, 5000, 10000, 25000, 50000)
+
+
+class PlacesCache:
+    """
+    Caches Places Nearby results keyed by (geohash cell of the search point, place type, radius bucket).
+
+    Entries younger than `fresh_for` seconds are served as is. Older entries (up to
+    `max_stale` seconds) are still served straight away, but a background refresh is
+    started so the next search gets fresh venues (stale-while-revalidate).
+    """
+    def __init__(self, precision: int = 7, fresh_for: float = 6 * 3600, max_stale: float = 7 * 24 * 3600,
+                 max_entries: int = 50000):
+        self.precision = precision
+        self.fresh_for = fresh_for
+        self.store = PersistentCache("places", max_entries=max_entries, ttl=max_stale, memory_entries=2000)
+
+        self.stale_hits = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def key(self, location: Coord, place_type: str, radius: int) -> str:
+        bucket = next((b for b in RADIUS_BUCKETS if b >= radius), RADIUS_BUCKETS[-1])
+        return f"{geohash(location, self.precision)}|{place_type}|{bucket}"
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], List[dict]]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                # Created lazily so no threads exist before gunicorn forks its workers
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="places-refresh")
+
+        def refresh():
+            try:
+                self.store.set(key, {"fetched_at": time.time(), "results": fetch()})
+            except Exception as e:
+                print(f"Error refreshing cached places for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(refresh)
+
+    def get(self, location: Coord, place_type: str, radius: int, fetch: Callable[[], List[dict]]) -> List[dict]:
+        """
+        Returns the cached results for this search, calling fetch() (which should return the
+        Places 'results' list) on a miss, or in the background when the entry is stale
+        """
+        key = self.key(location, place_type, radius)
+        entry = self.store.get(key)
+        if entry is not None:
+            if time.time() - entry["fetched_at"] > self.fresh_for:
+                with self._lock:
+                    self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+            return entry["results"]
+
+        results = fetch()
+        self.store.set(key, {"fetched_at": time.time(), "results": results})
+        return results
+
+    def stats(self) -> dict:
+        stats = self.store.stats()
+        stats["stale_hits"] = self.stale_hits
+        return stats
+
+
+places_cache = PlacesCache(
+    precision=int(os.environ.get("PLACES_CACHE_GEOHASH_PRECISION", 7)),
+    fresh_for=float(os.environ.get("PLACES_CACHE_FRESH_FOR", 6 * 3600)),
+    max_stale=float(os.environ.get("PLACES_CACHE_MAX_STALE", 7 * 24 * 3600)),
+)
+
+
+def collect_places_cache_metrics():
+    yield ("places_cache_stale_hits_total", "counter", "Stale Places results served while refreshing in the background",
+           [({}, places_cache.stale_hits)])
+
+
+metrics.registry.add_collector(collect_places_cache_metrics)
@@ -0,0 +1,76 @@
+import cProfile
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+# Profile one in every PROFILE_SAMPLE_RATE requests (0 turns profiling off)
+PROFILE_SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "profiles"),
+)
+
+
+class RequestProfiler:
+    """
+    Samples requests with cProfile and dumps each profile to directory as a .prof file
+    (open with `python -m pstats` or snakeviz).
+
+    On Python 3.12 and later cProfile records every thread in the process, so a sampled
+    profile also contains the work of the thread pools (Places, Distance Matrix, search jobs)
+    and of any other request running at the same time. One request is profiled at a time;
+    samples that come up while another is running are skipped.
+    """
+    def __init__(self, sample_rate: int = PROFILE_SAMPLE_RATE, directory: str = PROFILE_DIR):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.requests = 0
+        self.profiled = 0
+        self._active = False
+        self._lock = threading.Lock()
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """Starts profiling if this request is sampled; returns the profiler to pass to stop()"""
+        if self.sample_rate <= 0:
+            return None
+        with self._lock:
+            self.requests += 1
+            if self.requests % self.sample_rate or self._active:
+                return None
+            self._active = True
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler (e.g. a debugger) is already running
+            print(f"Could not start profiler: {e}")
+            with self._lock:
+                self._active = False
+            return None
+        return profiler
+
+    def stop(self, profiler: Optional[cProfile.Profile], name: str) -> Optional[str]:
+        """Stops profiler and writes its profile, named after the request; returns the file path"""
+        if profiler is None:
+            return None
+        profiler.disable()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "request"
+            path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{os.getpid()}-{safe_name}.prof")
+            profiler.dump_stats(path)
+            with self._lock:
+                self.profiled += 1
+            return path
+        except OSError as e:
+            print(f"Could not save profile: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._active = False
+
+
+request_profiler = RequestProfiler()
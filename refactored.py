@@ -1,25 +1,38 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 import os
-import googlemaps
+import contextvars
+import hashlib
+import secrets
 import math
-from typing import List, Dict, Tuple, Any
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import json
-import requests
-from geopy.distance import distance
 import math, random
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import OperationalError
 
+import metrics
+from autocomplete import autocomplete_cache
+from cache import PersistentCache
+from distance_matrix import get_travel_time_matrices, plan_tiles
+from extensions import db
+from geometry import Coord, haversine_matrix, sunflower_offsets
+from optimizer import find_fair_meeting_point, should_probe
+from places_cache import places_cache
+from scoring import STRATEGIES, ScoreTable, primary_key_lower_bound, primary_key_upper_bound
+from transport import LazyClient
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///meetingpoints.db'
-db = SQLAlchemy(app)
 
 # APIKEY
 GOOG_API_KEY = os.environ.get("GOOG_API_KEY")
 
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=GOOG_API_KEY)
+# Google Maps client, built on first use (shares this worker's pooled transport, see transport.py)
+gmaps = LazyClient()
+
+# Receives pipeline progress as (event name, JSON-friendly data), see get_all_locations_for_group
+EventCallback = Optional[Callable[[str, Dict[str, Any]], None]]
 
 # Models
 class Person:
@@ -30,19 +43,31 @@ class Person:
         self.name = name
         self.location = location
         self.transport_mode = transport_mode
-        self.geocoded_location = None  # Will be populated by geocoding
+        self.geocoded_location: Coord | None = None  # Will be populated by geocoding
     
     def __repr__(self):
         return f"Person(name={self.name}, location={self.location}, mode={self.transport_mode})"
 
 class Meeting(db.Model):
     """
-    Updated Meeting model to handle multiple people
+    Snapshot of a computed search: the group, place type, sort method and the ranked places
+    with their travel times, so it can be served again from /meeting/<token> without any API calls
     """
-    id = db.Column(db.Integer, primary_key=True)
+    __table_args__ = (
+        # Finds an earlier snapshot of the same search, see find_recent_meeting
+        db.Index("meeting_group", "group_signature", "place_type", "sort_method", "created_at"),
+        db.Index("meeting_token", "token", unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # Internal only, permalinks use token
+    token = db.Column(db.String(32))  # Unguessable permalink key, see save_meeting
     meeting_data = db.Column(db.Text)  # JSON string storing all people data
-    meeting_point = db.Column(db.String(100))
+    meeting_point = db.Column(db.String(100))  # Name of the best place
     place_type = db.Column(db.String(50))
+    group_signature = db.Column(db.String(64))  # See group_signature
+    sort_method = db.Column(db.String(20))
+    places_data = db.Column(db.Text)  # JSON list of Place.to_dict(), best first
+    created_at = db.Column(db.Float)  # Unix time
     
     def set_people_data(self, people: List[Person]):
         """Store people data as JSON"""
@@ -62,7 +87,88 @@ class Meeting(db.Model):
         people_data = json.loads(self.meeting_data)
         return [Person(p['name'], p['location'], p['transport_mode']) for p in people_data]
 
+    def set_places(self, places: List["Place"]):
+        """Store the ranked places (with travel times and metrics) as JSON"""
+        self.places_data = json.dumps([place.to_dict() for place in places])
+        self.meeting_point = places[0].name[:100] if places else None
+
+    def get_places(self) -> List["Place"]:
+        """Retrieve the ranked places from JSON"""
+        if not self.places_data:
+            return []
+        return [Place.from_dict(place) for place in json.loads(self.places_data)]
+
+class TravelTimes:
+    """
+    Travel times (seconds) for one search, stored as a people x places matrix.
+
+    Rows follow the order of the people list and columns the order of the places,
+    so two people with the same name keep separate travel times. NaN means the
+    travel time hasn't been set.
+    """
+    __slots__ = ("people_names", "times")
+
+    def __init__(self, people_names: List[str], num_places: int):
+        self.people_names = list(people_names)
+        self.times = np.full((len(self.people_names), num_places), np.nan)
+
+    @classmethod
+    def attach(cls, people: List[Person], places: List["Place"]) -> "TravelTimes":
+        """Creates a matrix for people x places and points every place at its column"""
+        store = cls([person.name for person in people], len(places))
+        for place_idx, place in enumerate(places):
+            place._store = store
+            place._index = place_idx
+        return store
+
+class PlaceTravelTimes:
+    """
+    Read-only view of one place's column in a TravelTimes matrix.
+
+    Behaves like the old {person_name: seconds} dict for templates and
+    print_meeting_analysis, but items() yields one pair per person, even if names repeat.
+    """
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: TravelTimes, index: int):
+        self._store = store
+        self._index = index
+
+    def items(self) -> List[Tuple[str, int]]:
+        column = self._store.times[:, self._index].tolist()
+        return [(name, int(time)) for name, time in zip(self._store.people_names, column) if time == time]
+
+    def keys(self) -> List[str]:
+        return [name for name, _ in self.items()]
+
+    def values(self) -> List[int]:
+        return [time for _, time in self.items()]
+
+    def __getitem__(self, person_name: str) -> int:
+        for name, time in self.items():
+            if name == person_name:
+                return time
+        raise KeyError(person_name)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(~np.isnan(self._store.times[:, self._index])))
+
+    def __repr__(self):
+        return repr(self.items())
+
 class Place:
+    """
+    A candidate meeting place. Travel times live in a TravelTimes matrix shared by
+    every place of the search; the place only keeps its column index.
+    """
+    __slots__ = ("name", "address", "rating", "total_ratings", "business_image_link", "embed_link",
+                 "latitude", "longitude", "_store", "_index",
+                 "max_travel_time", "total_travel_time", "travel_time_variance", "fairness_score",
+                 "travel_time_error")
+
     def __init__(self, name: str, address: str, rating: float, total_ratings: int, 
                  business_image_link: str, embed_link: str, latitude: float, longitude: float):
         self.name = name
@@ -74,19 +180,57 @@ class Place:
         self.latitude = latitude
         self.longitude = longitude
         
-        # Dictionary to store travel times from each person
-        self.travel_times = {}  # {person_name: travel_time_seconds}
+        # Travel times from each person, set by TravelTimes.attach
+        self._store = None
+        self._index = 0
         
         # Calculated metrics
         self.max_travel_time = 0
         self.total_travel_time = 0
         self.travel_time_variance = 0
         self.fairness_score = 0  # Lower is better (less variance in travel times)
+        # Most seconds any travel time may be off by when it was estimated for a large group
+        # (see cluster_origins); 0 when every time is exact
+        self.travel_time_error = 0.0
+
+    @property
+    def coord(self) -> Coord:
+        return Coord(self.latitude, self.longitude)
+
+    @property
+    def key(self) -> str:
+        """Identifies this place within a search (the same venue found from two search points shares a key)"""
+        return f"{self.name}_{self.latitude}_{self.longitude}"
+
+    @property
+    def travel_times(self) -> PlaceTravelTimes:
+        """Travel times from each person, as (person name, seconds) pairs"""
+        if self._store is None:
+            self._store = TravelTimes([], 1)
+            self._index = 0
+        return PlaceTravelTimes(self._store, self._index)
+
+    @property
+    def travel_time_column(self) -> np.ndarray:
+        """This place's travel times, one per person (NaN where unknown)"""
+        if self._store is None:
+            return np.empty(0)
+        return self._store.times[:, self._index]
 
     def add_travel_time(self, person_name: str, travel_time: int):
-        """Add travel time for a specific person"""
-        if travel_time is not None:
-            self.travel_times[person_name] = travel_time
+        """
+        Add travel time for a specific person to a place that isn't part of a
+        TravelTimes matrix (each call adds a new person)
+        """
+        if travel_time is None:
+            return
+        if self._store is not None and self._store.times.shape[1] != 1:
+            raise ValueError("Place is part of a shared TravelTimes matrix; set times through it instead")
+        if self._store is None:
+            self._store = TravelTimes([], 1)
+            self._index = 0
+        self._store.people_names.append(person_name)
+        self._store.times = np.vstack([self._store.times, [[travel_time]]])
     
     def calculate_metrics(self):
         """Calculate various metrics for ranking this place"""
@@ -104,85 +248,184 @@ class Place:
         # Fairness score combines variance and max time
         self.fairness_score = (self.travel_time_variance + (self.max_travel_time * 0.1))/10000
 
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly copy of this place, including its travel times and metrics"""
+        return {
+            'name': self.name,
+            'address': self.address,
+            'rating': self.rating,
+            'total_ratings': self.total_ratings,
+            'business_image_link': self.business_image_link,
+            'embed_link': self.embed_link,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'travel_times': self.travel_times.items(),
+            'max_travel_time': self.max_travel_time,
+            'total_travel_time': self.total_travel_time,
+            'travel_time_variance': self.travel_time_variance,
+            'fairness_score': self.fairness_score,
+            'travel_time_error': self.travel_time_error,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Place":
+        """Rebuilds a place saved with to_dict"""
+        place = cls(data['name'], data['address'], data['rating'], data['total_ratings'],
+                    data['business_image_link'], data['embed_link'], data['latitude'], data['longitude'])
+        for person_name, travel_time in data['travel_times']:
+            place.add_travel_time(person_name, travel_time)
+        place.max_travel_time = data['max_travel_time']
+        place.total_travel_time = data['total_travel_time']
+        place.travel_time_variance = data['travel_time_variance']
+        place.fairness_score = data['fairness_score']
+        place.travel_time_error = data.get('travel_time_error', 0.0)
+        return place
+
     def __repr__(self):
         return (f"Place(name={self.name}, address={self.address}, rating={self.rating}, "
                 f"total_ratings={self.total_ratings}, travel_times={self.travel_times}, "
                 f"fairness_score={self.fairness_score:.2f})")
 
 # Helper functions
-def geocode(address: str) -> str | None:
+# Maximum number of concurrent Geocoding API calls per group
+GEOCODE_WORKERS = int(os.environ.get("GEOCODE_WORKERS", 8))
+
+# Geocoding results are cached on disk and shared between workers (see cache.py)
+geocoding_cache = PersistentCache(
+    "geocode",
+    max_entries=int(os.environ.get("GEOCODE_CACHE_SIZE", 20000)),
+    ttl=float(os.environ.get("GEOCODE_CACHE_TTL", 30 * 24 * 3600)),
+    memory_entries=int(os.environ.get("GEOCODE_CACHE_MEMORY_SIZE", 2000)),
+)
+
+def normalize_address(address: str) -> str:
+    """
+    Normalizes an address so that trivially different spellings share a cache entry,
+    e.g. " 1 George St,  Sydney NSW " and "1 george st, sydney nsw"
+    """
+    parts = [" ".join(part.split()) for part in address.lower().split(',')]
+    return ", ".join(part for part in parts if part).strip(" .")
+
+def geocode(address: str) -> Coord | None:
     """
     Geocodes one address (string) into a set of coordinates
     
-    Returns a string of latitude and longitude
+    Returns the latitude and longitude as a Coord
     """
+    key = normalize_address(address)
+    cached = geocoding_cache.get(key)
+    if cached is not None:
+        return Coord.parse(cached)
+
     result = gmaps.geocode(address)
     if result:
         location = result[0]['geometry']['location']
-        return f"{location['lat']},{location['lng']}"
+        coord = Coord(location['lat'], location['lng'])
+        geocoding_cache.set(key, list(coord))
+        return coord
     return None
 
-# Add to your class definitions
-geocoding_cache = {}  # Simple in-memory cache
+def _geocode_with_fallback(address: str) -> Coord | None:
+    """
+    Geocodes an address, retrying with a simplified version (just the first part)
+    if the full address has no results. Runs inside the geocoding thread pool.
+    """
+    result = gmaps.geocode(address)
+    if not result:
+        simplified = address.split(',')[0]
+        if simplified != address:
+            result = gmaps.geocode(simplified)
+    if result:
+        location = result[0]['geometry']['location']
+        return Coord(location['lat'], location['lng'])
+    return None
 
-def batch_geocode_people(people: List[Person]) -> List[Person]:
+def batch_geocode_people(people: List[Person], max_workers: int = GEOCODE_WORKERS) -> List[Person]:
     """
-    Optimized geocoding with caching and reduced API calls
+    Geocodes everyone in the group, using the cache where possible.
+
+    Uncached addresses are looked up in parallel (at most max_workers at a time), and
+    people sharing an address only cost one lookup. Pass max_workers=1 to geocode sequentially.
+    Every failed person is reported, not just the first one.
     """
-    # Check cache first
-    uncached_people = []
+    # Check cache first, grouping the misses by address
+    uncached = {}  # {normalized address: [Person, ...]}
     for person in people:
-        if person.location in geocoding_cache:
-            person.geocoded_location = geocoding_cache[person.location]
+        key = normalize_address(person.location)
+        cached = geocoding_cache.get(key)
+        if cached is not None:
+            # Older entries were stored as "lat,lng" strings
+            person.geocoded_location = Coord.parse(cached)
         else:
-            uncached_people.append(person)
+            uncached.setdefault(key, []).append(person)
     
-    # Batch geocode remaining locations
-    if uncached_people:
-        # Google Geocoding API supports batch requests, but Python client doesn't expose it well
-        # So we'll optimize by reducing individual calls through better error handling
-        for person in uncached_people:
-            try:
-                result = gmaps.geocode(person.location)
-                if result:
-                    location = result[0]['geometry']['location']
-                    coord_string = f"{location['lat']},{location['lng']}"
-                    person.geocoded_location = coord_string
-                    geocoding_cache[person.location] = coord_string
-                else:
-                    # Try a simplified version of the address
-                    simplified = person.location.split(',')[0]  # Just use first part
-                    result = gmaps.geocode(simplified)
-                    if result:
-                        location = result[0]['geometry']['location']
-                        coord_string = f"{location['lat']},{location['lng']}"
-                        person.geocoded_location = coord_string
-                        geocoding_cache[person.location] = coord_string
-                    else:
-                        raise ValueError(f"Could not geocode location for {person.name}: {person.location}")
-            except Exception as e:
+    if not uncached:
+        return people
+
+    # Geocode the remaining addresses concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(uncached)))) as executor:
+        futures = {key: executor.submit(_geocode_with_fallback, group[0].location)
+                   for key, group in uncached.items()}
+
+    errors = []
+    for key, future in futures.items():
+        group = uncached[key]
+        try:
+            coord = future.result()
+        except Exception as e:
+            for person in group:
                 print(f"Geocoding error for {person.name}: {e}")
-                raise
+            errors.append(e)
+            continue
+
+        if coord is None:
+            for person in group:
+                error = ValueError(f"Could not geocode location for {person.name}: {person.location}")
+                print(f"Geocoding error for {person.name}: {error}")
+                errors.append(error)
+            continue
+
+        geocoding_cache.set(key, list(coord))
+        for person in group:
+            person.geocoded_location = coord
+
+    if errors:
+        # API failures take priority over addresses that simply weren't found
+        for error in errors:
+            if not isinstance(error, ValueError):
+                raise error
+        raise ValueError("; ".join(str(error) for error in errors))
     
     return people
 
 def clear_geocoding_cache():
     """Clear the geocoding cache (useful for testing or memory management)"""
-    global geocoding_cache
     geocoding_cache.clear()
 
-def get_geographic_centroid(coords: List[str]) -> str:
+def warm_geocoding_cache(limit: int = None) -> int:
     """
-    Given a list of coordinates (lat,lng strings), return the geographic centroid
-    (center point on a sphere) as a "lat,lng" string.
+    Preloads the most frequently used addresses into this worker's memory,
+    so the common suburbs never hit SQLite or the Geocoding API.
+    Called once per worker at start-up (see gunicorn.conf.py).
+    """
+    return geocoding_cache.warm(limit)
+
+def get_geocoding_cache_stats() -> dict:
+    """Hit/miss counters and sizes of the geocoding cache"""
+    return geocoding_cache.stats()
+
+def get_geographic_centroid(coords: List[Coord]) -> Coord:
+    """
+    Given a list of coordinates, return the geographic centroid
+    (center point on a sphere).
 
     This is more accurate than a flat average, especially over long distances.
 
     Params:
-        coords (List[str]): List of coordinates as strings in "lat,lng" format
+        coords (List[Coord]): List of coordinates
 
     Returns:
-        centroid (str): Centroid as "lat,lng"
+        centroid (Coord): Centroid of the coordinates
     """
     if not coords:
         raise ValueError("Coordinate list is empty")
@@ -191,8 +434,7 @@ def get_geographic_centroid(coords: List[str]) -> str:
     y_total = 0.0
     z_total = 0.0
 
-    for coord in coords:
-        lat_deg, lng_deg = map(float, coord.split(','))
+    for lat_deg, lng_deg in coords:
         lat_rad = math.radians(lat_deg)
         lng_rad = math.radians(lng_deg)
 
@@ -218,9 +460,13 @@ def get_geographic_centroid(coords: List[str]) -> str:
     lat_deg = math.degrees(lat_rad)
     lng_deg = math.degrees(lng_rad)
 
-    return f"{lat_deg},{lng_deg}"
+    return Coord(lat_deg, lng_deg)
 
-def get_search_area_points(people: List[Person], num_points: int = 20, radius_ratio: float = 0.15) -> List[str]:
+# How search points are laid out around the centroid: "sunflower" (deterministic) or "random"
+SEARCH_LAYOUT = os.environ.get("SEARCH_LAYOUT", "sunflower")
+
+def get_search_area_points(people: List[Person], num_points: int = 20, radius_ratio: float = 0.15,
+                           layout: str = None, center: Coord = None) -> List[Coord]:
     """
     Generate search points around the geographic centroid of all people's locations.
     This replaces the midpoint-based approach for multiple people.
@@ -229,9 +475,12 @@ def get_search_area_points(people: List[Person], num_points: int = 20, radius_ra
         people: List of Person objects with geocoded locations
         num_points: Number of search points to generate
         radius_ratio: Radius as a ratio of the maximum distance from centroid
+        layout: "sunflower" spreads the points evenly and gives the same points for the same
+            group every time; "random" samples them. Defaults to SEARCH_LAYOUT.
+        center: Search around this point instead of the centroid (see get_fair_search_center)
     
     Returns:
-        List of coordinate strings for searching
+        List of coordinates for searching
     """
     # Get all coordinates
     coords = [person.geocoded_location for person in people if person.geocoded_location]
@@ -240,22 +489,26 @@ def get_search_area_points(people: List[Person], num_points: int = 20, radius_ra
         raise ValueError("Need at least 2 valid locations")
     
     # Calculate centroid
-    centroid = get_geographic_centroid(coords)
-    centroid_lat, centroid_lng = map(float, centroid.split(','))
+    centroid = center or get_geographic_centroid(coords)
+    centroid_lat, centroid_lng = centroid
     
     # Calculate maximum distance from centroid to any person
     max_distance = 0
-    for coord in coords:
-        lat, lng = map(float, coord.split(','))
+    for lat, lng in coords:
         dist = math.sqrt((lat - centroid_lat) ** 2 + (lng - centroid_lng) ** 2)
         max_distance = max(max_distance, dist)
     
     # Generate search radius
     search_radius = radius_ratio * max_distance
     
-    # Generate random points around the centroid
     search_points = [centroid]  # Include the centroid itself
     
+    if (layout or SEARCH_LAYOUT) == "sunflower":
+        for dlat, dlng in sunflower_offsets(num_points - 1, search_radius):
+            search_points.append(Coord(centroid_lat + dlat, centroid_lng + dlng))
+        return search_points
+    
+    # Generate random points around the centroid
     for _ in range(num_points - 1):
         # Random angle and distance
         angle = random.uniform(0, 2 * math.pi)
@@ -264,17 +517,51 @@ def get_search_area_points(people: List[Person], num_points: int = 20, radius_ra
         # Calculate new point
         lat = centroid_lat + distance * math.cos(angle)
         lng = centroid_lng + distance * math.sin(angle)
-        search_points.append(f"{lat},{lng}")
+        search_points.append(Coord(lat, lng))
     
     return search_points
 
-def find_nearby_places(location, place_type, radius=1500, max_results=8):
+# Which optimizer objective suits each ranking strategy
+OPTIMIZER_OBJECTIVES = {"minimize_max": "max", "minimize_total": "total"}
+
+def get_fair_search_center(people: List[Person], ranking_strategy: str = "fairness") -> Coord:
+    """
+    Finds the point to search for places around. Starts at the geographic centroid and,
+    within the OPTIMIZER_PROBES budget, moves towards the point with the fairest measured
+    travel times - e.g. towards the walker when someone else is driving. Large groups probe
+    from their clustered origins (see cluster_origins). Groups that don't mix transport modes
+    stay at the centroid (see should_probe).
+    """
+    coords = [person.geocoded_location for person in people]
+    centroid = get_geographic_centroid(coords)
+    if use_clustering(people):
+        coords = cluster_origins(people)[0]
+    objective = OPTIMIZER_OBJECTIVES.get(ranking_strategy, "fairness")
+    center, stats = find_fair_meeting_point(gmaps, coords, [person.transport_mode for person in people],
+                                            centroid, objective)
+    if stats["probes"]:
+        print(f"Meeting point optimizer: {stats['probes']} probes, {stats['elements']} elements, "
+              f"score {stats['start_score']} -> {stats['best_score']}")
+    return center
+
+# Maximum number of concurrent Places searches per group
+PLACES_WORKERS = int(os.environ.get("PLACES_WORKERS", 8))
+
+def places_nearby_cached(location: Coord, place_type: str, radius: int) -> List[dict]:
+    """
+    One Places Nearby search, served from places_cache when a nearby search of the same
+    type and radius bucket was made recently (stale entries are refreshed in the background)
+    """
+    def fetch():
+        return gmaps.places_nearby(location=str(location), radius=radius, type=place_type).get('results', [])
+    return places_cache.get(location, place_type, radius, fetch)
+
+def find_nearby_places(location: Coord, place_type, radius=1500, max_results=8):
     """
     Optimized version that's smarter about radius increases
     """
     try:
-        places = gmaps.places_nearby(location=location, radius=radius, type=place_type)
-        results = places.get('results', [])
+        results = places_nearby_cached(location, place_type, radius)
         
         # If we have enough results, return them
         if len(results) >= max_results:
@@ -283,8 +570,7 @@ def find_nearby_places(location, place_type, radius=1500, max_results=8):
         # If not enough results, try ONE larger radius instead of multiple increases
         if len(results) < max_results and radius < 5000:
             larger_radius = min(radius * 2, 5000)  # Double radius but cap at 5km
-            places = gmaps.places_nearby(location=location, radius=larger_radius, type=place_type)
-            results = places.get('results', [])
+            results = places_nearby_cached(location, place_type, larger_radius)
         
         return {"results": results[:max_results]}
         
@@ -293,6 +579,22 @@ def find_nearby_places(location, place_type, radius=1500, max_results=8):
         return {"results": []}
 
 
+def find_nearby_places_concurrently(locations: List[Coord], place_type: str, max_results: int = 8,
+                                    max_workers: int = None) -> List[dict]:
+    """
+    Runs find_nearby_places for every location in parallel, using at most max_workers
+    threads (PLACES_WORKERS by default).
+
+    Results are returned in the same order as locations, so merging them gives
+    exactly the same output as searching one point at a time.
+    """
+    if not locations:
+        return []
+    max_workers = PLACES_WORKERS if max_workers is None else max_workers
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(locations)))) as executor:
+        return list(executor.map(lambda location: find_nearby_places(location, place_type, max_results=max_results),
+                                 locations))
+
 def find_places_optimized(people: List[Person], place_type: str, max_results: int = 10) -> dict:
     """
     Optimized version that uses fewer API calls by:
@@ -304,10 +606,9 @@ def find_places_optimized(people: List[Person], place_type: str, max_results: in
     
     # Calculate appropriate radius based on spread of people
     max_distance_km = 0
-    centroid_lat, centroid_lng = map(float, centroid.split(','))
+    centroid_lat, centroid_lng = centroid
     
-    for coord in coords:
-        lat, lng = map(float, coord.split(','))
+    for lat, lng in coords:
         # Convert to kilometers (rough approximation)
         distance_km = math.sqrt((lat - centroid_lat) ** 2 + (lng - centroid_lng) ** 2) * 111
         max_distance_km = max(max_distance_km, distance_km)
@@ -353,91 +654,307 @@ def get_business_image(place_data):
         return get_place_photo_url(photo_reference)
     return None
 
-def get_travel_times_optimized(people: List[Person], places: List[Place]) -> List[Place]:
+def get_travel_times_optimized(people: List[Person], places: List[Place], on_event: EventCallback = None,
+                               cluster: bool = True, refine_strategy: str = None) -> List[Place]:
     """
-    Optimized travel time calculation with reduced API calls
+    Optimized travel time calculation with reduced API calls.
+
+    People are grouped by transport mode and each mode's matrix is split into tiles
+    that fit the Distance Matrix limits, so large groups don't fail as a whole.
+    People leaving from the same address share a row, and all tiles run concurrently.
+    If on_event is given, a "scores" event with the partial metrics of the affected
+    places is sent as each tile arrives.
+
+    Groups of LARGE_GROUP_SIZE or more people (unless cluster is False) only get rows for
+    representative origins, and everyone else's times are estimated from their nearest
+    representative's (see cluster_origins); the places' travel_time_error says by how much
+    they may be off. With refine_strategy, the CLUSTER_REFINE places most likely to rank best
+    under it (see estimated_top_places) get exact times for everyone in the same batch, which is
+    usually all of refine_top_places' work done without a round of its own; they are padded
+    with the next likeliest places that fit in the same tiles (see fill_refine_tiles). Clustering
+    is skipped when it wouldn't take fewer tiles than exact times for everyone.
     """
     if not people or not places:
         return places
     
-    # Check if everyone has the same transport mode
-    transport_modes = set(person.transport_mode for person in people)
+    destinations = [place.coord for place in places]
+    store = TravelTimes.attach(people, places)
+    origins, error = [person.geocoded_location for person in people], 0.0
+    exact = set()  # Places everyone gets exact times for despite clustering
+    if cluster and use_clustering(people):
+        origins, errors = cluster_origins(people)
+        error = float(errors.max())
+        print(f"Clustered {len(people)} origins into {len(set(origins))} "
+              f"(travel times off by at most {error / 60:.1f} min)")
+        if refine_strategy is not None and CLUSTER_REFINE > 0:
+            likely = estimated_top_places(people, places, refine_strategy, len(places))
+            exact = set(map(id, fill_refine_tiles(people, likely[:CLUSTER_REFINE], likely)))
+        if not clustering_saves_requests(people, origins, len(places), len(exact)):
+            print("Clustering wouldn't save any requests, using exact travel times")
+            origins, error, exact = [person.geocoded_location for person in people], 0.0, set()
+    for place in places:
+        place.travel_time_error = 0.0 if id(place) in exact else error
+    estimated_columns = [i for i, place in enumerate(places) if id(place) not in exact]
+    exact_columns = [i for i, place in enumerate(places) if id(place) in exact]
     
-    origins = [person.geocoded_location for person in people]
-    destinations = [f"{place.latitude},{place.longitude}" for place in places]
+    # Group by transport mode - one matrix per mode (and one more for the exact places)
+    mode_groups = {}  # {mode: [person index, ...]}
+    for person_idx, person in enumerate(people):
+        mode_groups.setdefault(person.transport_mode, []).append(person_idx)
     
-    if len(transport_modes) == 1:
-        # Everyone has same transport mode - single API call
-        mode = list(transport_modes)[0]
-        try:
-            matrix = gmaps.distance_matrix(
-                origins=origins,
-                destinations=destinations,
-                mode=mode
-            )
-            
-            # Process results
-            for person_idx, person in enumerate(people):
-                for place_idx, place in enumerate(places):
-                    element = matrix['rows'][person_idx]['elements'][place_idx]
-                    if element['status'] == 'OK':
-                        travel_time = element['duration']['value']
-                        place.add_travel_time(person.name, travel_time)
-                    else:
-                        place.add_travel_time(person.name, 9999)
-                        
-        except Exception as e:
-            print(f"Error in distance matrix call: {e}")
-            # Fallback to high penalty times
-            for person in people:
-                for place in places:
-                    place.add_travel_time(person.name, 9999)
+    jobs = []
+    job_cells = []  # [(person indexes, place indexes)] each job's rows and columns stand for
+    for mode, person_indexes in mode_groups.items():
+        if estimated_columns:
+            jobs.append(([origins[person_idx] for person_idx in person_indexes],
+                         [destinations[i] for i in estimated_columns], mode))
+            job_cells.append((person_indexes, estimated_columns))
+        if exact_columns:
+            jobs.append(([people[person_idx].geocoded_location for person_idx in person_indexes],
+                         [destinations[i] for i in exact_columns], mode))
+            job_cells.append((person_indexes, exact_columns))
+    stats = {}
+    on_tile = None
+    if on_event is not None:
+        ratings = [place.rating or 0.0 for place in places]
+        tile_lock = threading.Lock()
+
+        def on_tile(job_number, cells):
+            person_indexes, place_indexes = job_cells[job_number]
+            with tile_lock:
+                for origin, destination, travel_time in cells:
+                    store.times[person_indexes[origin], place_indexes[destination]] = (
+                        travel_time if travel_time is not None else 9999)
+                columns = sorted({place_indexes[destination] for _, destination, _ in cells})
+                on_event("scores", {"places": partial_scores([places[i] for i in columns],
+                                                             ScoreTable(store.times[:, columns],
+                                                                        [ratings[i] for i in columns]))})
+
+    with metrics.stage("distance_matrix"):
+        matrices = get_travel_time_matrices(gmaps, jobs, stats=stats, on_tile=on_tile)
+    print(f"Distance matrix: requested {stats['elements_requested']} of {stats['elements_total']} elements "
+          f"({stats['elements_saved']} saved, {stats['elements_cached']} from cache) in {stats['requests']} requests")
     
-    else:
-        # Multiple transport modes - but optimize by checking if we can reduce modes
-        # For example, if someone chose "transit" but it's not available, fall back to "walking"
-        
-        # Group by transport mode but be smarter about it
-        mode_groups = {}
-        for person in people:
-            # Normalize transport modes (e.g., "car" -> "driving")
-            normalized_mode = person.transport_mode
-            if normalized_mode not in mode_groups:
-                mode_groups[normalized_mode] = []
-            mode_groups[normalized_mode].append(person)
-        
-        # Make API calls for each unique mode
-        for mode, people_group in mode_groups.items():
-            group_origins = [person.geocoded_location for person in people_group]
-            
-            try:
-                matrix = gmaps.distance_matrix(
-                    origins=group_origins,
-                    destinations=destinations,
-                    mode=mode
-                )
-                
-                for person_idx, person in enumerate(people_group):
-                    for place_idx, place in enumerate(places):
-                        element = matrix['rows'][person_idx]['elements'][place_idx]
-                        if element['status'] == 'OK':
-                            travel_time = element['duration']['value']
-                            place.add_travel_time(person.name, travel_time)
-                        else:
-                            place.add_travel_time(person.name, 9999)
-            
-            except Exception as e:
-                print(f"Error calculating travel times for mode {mode}: {e}")
-                for person in people_group:
-                    for place in places:
-                        place.add_travel_time(person.name, 9999)
+    for (person_indexes, place_indexes), matrix in zip(job_cells, matrices):
+        # Unreachable places (or failed requests) get a high penalty time
+        store.times[np.ix_(person_indexes, place_indexes)] = [
+            [travel_time if travel_time is not None else 9999 for travel_time in row] for row in matrix]
     
-    # Calculate metrics for each place
-    for place in places:
-        place.calculate_metrics()
+    # Calculate metrics for every place in one pass
+    score_places(places)
     
     return places
 
+def build_score_table(places: List[Place]) -> ScoreTable:
+    """
+    Builds a ScoreTable (people x places matrix) from the places' travel times
+    """
+    ratings = [place.rating or 0.0 for place in places]
+    stores = {id(place._store) for place in places}
+    if len(stores) == 1 and places[0]._store is not None:
+        # Usual case: every place comes from the same search, so just pick out the columns
+        return ScoreTable(places[0]._store.times[:, [place._index for place in places]], ratings)
+
+    columns = [place.travel_time_column for place in places]
+    times = np.full((max((len(column) for column in columns), default=0), len(places)), np.nan)
+    for place_idx, column in enumerate(columns):
+        times[:len(column), place_idx] = column
+    return ScoreTable(times, ratings)
+
+def partial_scores(places: List[Place], table: ScoreTable) -> List[Dict[str, Any]]:
+    """Metrics so far for places whose travel times are still arriving (table holds their columns)"""
+    known = (~np.isnan(table.times)).sum(axis=0).tolist()
+    return [{
+        'key': place.key,
+        'travel_times': place.travel_times.items(),
+        'max_travel_time': int(max_time),
+        'total_travel_time': int(total_time),
+        'fairness_score': fairness,
+        'travel_time_error': place.travel_time_error,
+        'complete': count == table.times.shape[0],
+    } for place, max_time, total_time, fairness, count in zip(
+        places, table.max.tolist(), table.total.tolist(), table.fairness.tolist(), known)]
+
+def score_places(places: List[Place]) -> ScoreTable:
+    """
+    Vectorized version of Place.calculate_metrics for a whole list of places.
+    Stores the metrics on each place and returns the ScoreTable for ranking.
+    """
+    with metrics.stage("scoring"):
+        table = build_score_table(places)
+        for place, max_time, total_time, variance, fairness in zip(
+                places, table.max.tolist(), table.total.tolist(), table.variance.tolist(), table.fairness.tolist()):
+            if not place.travel_times:
+                continue
+            place.max_travel_time = int(max_time)
+            place.total_travel_time = int(total_time)
+            place.travel_time_variance = variance
+            place.fairness_score = fairness
+        return table
+
+# Upper limits on door-to-door speed (m/s) for each mode. Nobody can reach a place faster
+# than the straight-line distance at these speeds, which bounds travel times from below.
+MAX_SPEEDS = {
+    "walking": float(os.environ.get("MAX_SPEED_WALKING", 3.0)),
+    "bicycling": float(os.environ.get("MAX_SPEED_BICYCLING", 12.0)),
+    "driving": float(os.environ.get("MAX_SPEED_DRIVING", 40.0)),
+    "transit": float(os.environ.get("MAX_SPEED_TRANSIT", 50.0)),
+}
+
+# Lower limits on door-to-door speed (m/s) for each mode over short trips, detours, parking
+# and waiting included. Nobody takes longer than the straight-line distance at these speeds to
+# get somewhere nearby, which bounds how far apart two nearby people's travel times can be.
+MIN_SPEEDS = {
+    "walking": float(os.environ.get("MIN_SPEED_WALKING", 1.0)),
+    "bicycling": float(os.environ.get("MIN_SPEED_BICYCLING", 2.5)),
+    "driving": float(os.environ.get("MIN_SPEED_DRIVING", 3.0)),
+    "transit": float(os.environ.get("MIN_SPEED_TRANSIT", 1.0)),  # Short hops are walked
+}
+
+# Groups of at least this many people get estimated travel times from clustered origins (0 disables)
+LARGE_GROUP_SIZE = int(os.environ.get("LARGE_GROUP_SIZE", 20))
+# Most seconds an estimated travel time may be off by
+CLUSTER_MAX_ERROR = float(os.environ.get("CLUSTER_MAX_ERROR", 300))
+# How many of a large group's best places get exact travel times before they're shown (0 disables)
+CLUSTER_REFINE = int(os.environ.get("CLUSTER_REFINE", 3))
+
+def use_clustering(people: List[Person]) -> bool:
+    return LARGE_GROUP_SIZE > 0 and len(people) >= LARGE_GROUP_SIZE
+
+def cluster_origins(people: List[Person], max_error: float = CLUSTER_MAX_ERROR) -> Tuple[List[Coord], np.ndarray]:
+    """
+    Picks representative origins for a large group, so the distance matrix only needs a row per
+    representative instead of one per person.
+
+    People are clustered per transport mode: whoever has the most people of their mode within
+    max_error seconds at the mode's MIN_SPEEDS becomes a representative for all of them, until
+    everyone is covered. A person's travel time to any place differs from their
+    representative's by at most the time between the two of them (either can go via the
+    other), and that is at most their distance at MIN_SPEEDS.
+
+    Returns each person's origin (their representative's location) and the bound on their
+    error in seconds (0 for representatives)
+    """
+    origins = [person.geocoded_location for person in people]
+    errors = np.zeros(len(people))
+    mode_groups = {}  # {mode: [person index, ...]}
+    for person_idx, person in enumerate(people):
+        mode_groups.setdefault(person.transport_mode, []).append(person_idx)
+
+    slowest = min(MIN_SPEEDS.values())
+    for mode, person_indexes in mode_groups.items():
+        speed = MIN_SPEEDS.get(mode, slowest)
+        points = [people[i].geocoded_location for i in person_indexes]
+        distances = haversine_matrix(points, points)
+        within = distances <= max_error * speed
+        uncovered = np.ones(len(points), dtype=bool)
+        while uncovered.any():
+            representative = int(np.argmax((within & uncovered).sum(axis=1)))
+            members = np.flatnonzero(within[representative] & uncovered)
+            for member in members:
+                origins[person_indexes[member]] = points[representative]
+                errors[person_indexes[member]] = distances[representative, member] / speed
+            uncovered[members] = False
+    return origins, errors
+
+# Whether to skip Distance Matrix elements for places that can't make the top results
+PRUNE_CANDIDATES = os.environ.get("PRUNE_CANDIDATES", "1") == "1"
+
+def get_travel_time_lower_bounds(people: List[Person], places: List[Place]) -> np.ndarray:
+    """
+    Lower bounds (seconds) on every person's travel time to every place, as a people x places
+    array, from the great-circle distance and the person's mode's maximum speed
+    """
+    distances = haversine_matrix([person.geocoded_location for person in people], [place.coord for place in places])
+    fastest = max(MAX_SPEEDS.values())
+    speeds = np.array([MAX_SPEEDS.get(person.transport_mode, fastest) for person in people])
+    return distances / speeds[:, None]
+
+# Typical door-to-door speeds (m/s) over the straight-line distance for each mode. Only used to
+# guess whether pruning can pay off, never to rule a place out.
+TYPICAL_SPEEDS = {
+    "walking": float(os.environ.get("TYPICAL_SPEED_WALKING", 1.1)),
+    "bicycling": float(os.environ.get("TYPICAL_SPEED_BICYCLING", 3.5)),
+    "driving": float(os.environ.get("TYPICAL_SPEED_DRIVING", 7.0)),
+    "transit": float(os.environ.get("TYPICAL_SPEED_TRANSIT", 4.0)),
+}
+
+def estimated_travel_times(people: List[Person], places: List[Place]) -> np.ndarray:
+    """Rough travel times (seconds, people x places) from the straight-line distances at TYPICAL_SPEEDS"""
+    distances = haversine_matrix([person.geocoded_location for person in people], [place.coord for place in places])
+    slowest = min(TYPICAL_SPEEDS.values())
+    speeds = np.array([TYPICAL_SPEEDS.get(person.transport_mode, slowest) for person in people])
+    return distances / speeds[:, None]
+
+def estimated_top_places(people: List[Person], places: List[Place], strategy: str, k: int) -> List[Place]:
+    """The k places most likely to rank best under strategy, judged by estimated_travel_times"""
+    if strategy not in STRATEGIES:
+        strategy = "fairness_then_max"
+    table = ScoreTable(estimated_travel_times(people, places), [place.rating or 0.0 for place in places])
+    return [places[i] for i in table.top_k(strategy, k)]
+
+def pruning_can_pay_off(people: List[Person], places: List[Place], bounds: np.ndarray, strategy: str,
+                        k: int) -> bool:
+    """
+    Whether any place's lower bound is likely to be above the kth best exact key, estimated
+    from the straight-line distances at TYPICAL_SPEEDS. If none is, pruning would only split
+    the distance matrix into two rounds without skipping anything.
+    """
+    ratings = [place.rating or 0.0 for place in places]
+    estimates = ScoreTable(estimated_travel_times(people, places), ratings).sort_keys(strategy)[0]
+    return bool(np.any(bounds > np.partition(estimates, k - 1)[k - 1]))
+
+def get_travel_times_pruned(people: List[Person], places: List[Place], strategy: str, k: int,
+                            on_event: EventCallback = None) -> List[Place]:
+    """
+    Like get_travel_times_optimized, but skips places that provably can't make the top k under strategy.
+
+    1. Bound every place's sort key from below using straight-line travel time bounds
+    2. Get exact travel times for the k places with the best bounds
+    3. Drop every other place whose bound is already worse than the kth best exact key
+       (or, for estimated travel times, than the kth best upper bound on the key)
+    4. Get exact travel times for the places that are left
+
+    When no bound looks like it can beat the kth best key (see pruning_can_pay_off, usually
+    the case for the time-based strategies), every place is looked up in one round instead.
+
+    Returns the places that were evaluated (pruned places are left out). on_event is passed
+    to get_travel_times_optimized, plus a "pruned" event listing the keys of the skipped places.
+    """
+    if strategy not in STRATEGIES:
+        # Unknown strategies keep the fairness order (see rank_places_by_strategy)
+        strategy = "fairness_then_max"
+    if len(places) <= k:
+        return get_travel_times_optimized(people, places, on_event, refine_strategy=strategy)
+
+    ratings = [place.rating or 0.0 for place in places]
+    bounds = primary_key_lower_bound(ScoreTable(get_travel_time_lower_bounds(people, places), ratings), strategy)
+    if not pruning_can_pay_off(people, places, bounds, strategy, k):
+        return get_travel_times_optimized(people, places, on_event, refine_strategy=strategy)
+    order = np.argsort(bounds, kind="stable")
+    first = [places[i] for i in order[:k]]
+    rest = order[k:]
+
+    get_travel_times_optimized(people, first, on_event, refine_strategy=strategy)
+    reachable = [place for place in first if np.all(place.travel_time_column < 9999)]
+    if len(reachable) < k:
+        # Not enough valid places to set a threshold, so nothing can be ruled out
+        get_travel_times_optimized(people, [places[i] for i in rest], on_event)
+        return places
+
+    # Estimated times (large groups) may be too low, so only rule out what their upper bound can't beat
+    error = max(place.travel_time_error for place in reachable)
+    keys = primary_key_upper_bound(build_score_table(reachable), strategy, error)
+    threshold = np.partition(keys, k - 1)[k - 1]
+    remaining = [places[i] for i in rest if bounds[i] <= threshold]
+    if on_event is not None:
+        on_event("pruned", {"keys": [places[i].key for i in rest if bounds[i] > threshold]})
+    get_travel_times_optimized(people, remaining, on_event)
+
+    print(f"Pruned {len(rest) - len(remaining)} of {len(places)} candidate places before the distance matrix")
+    kept = set(map(id, first + remaining))
+    return [place for place in places if id(place) in kept]
+
 def get_embed_link(lat, lng):
     return f"https://www.google.com/maps/embed/v1/place?q={lat},{lng}&key={GOOG_API_KEY}"
 
@@ -473,7 +990,9 @@ def parse_places(json_data: dict) -> List[Place]:
 
     return places
 
-def get_middle_locations_multi_person(people: List[Person], location_type: str, max_places: int = 10) -> List[Place]:
+def get_middle_locations_multi_person(people: List[Person], location_type: str, max_places: int = 10,
+                                      ranking_strategy: str = "fairness", ranking_k: int = None,
+                                      on_event: EventCallback = None) -> List[Place]:
     """
     Find meeting places that are relatively fair for all people involved.
     
@@ -481,74 +1000,324 @@ def get_middle_locations_multi_person(people: List[Person], location_type: str,
         people: List of Person objects with locations and transport modes
         location_type: Type of place to search for
         max_places: Maximum number of places to return
+        ranking_strategy, ranking_k: How the caller will rank the result and how many places it keeps.
+            Places that can't make that top ranking_k are skipped before the distance matrix.
+            Without ranking_k (as for the candidates API, which serves every strategy) only
+            places that can't make the top max_places by fairness are skipped, which with the
+            usual 15 or fewer candidates means none.
+        on_event: Optional progress callback (see get_all_locations_for_group)
     
     Returns:
         List of Place objects sorted by fairness score
     """
     # Geocode all locations
-    people = batch_geocode_people(people)
+    with metrics.stage("geocode"):
+        people = batch_geocode_people(people)
+    if on_event is not None:
+        on_event("geocoded", {"people": [{'name': person.name, 'location': person.location,
+                                          'transport': person.transport_mode,
+                                          'lat': person.geocoded_location.lat, 'lng': person.geocoded_location.lng}
+                                         for person in people]})
     
-    # Generate search points around the geographic centroid
-    search_points = get_search_area_points(people, num_points=5)  # Reduced for API efficiency
+    # Search around the centroid straight away. If the optimizer probes this group, it runs
+    # alongside the Places searches, and a center it moved gets searched around as well
+    probe = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if should_probe([person.transport_mode for person in people]):
+            probe = executor.submit(contextvars.copy_context().run, get_fair_search_center, people, ranking_strategy)
+        with metrics.stage("search_points"):
+            search_points = get_search_area_points(people, num_points=5)  # Reduced for API efficiency
+        
+        # Find places near each search point (all points are searched at once)
+        with metrics.stage("places"):
+            nearby = find_nearby_places_concurrently(search_points, location_type, max_results=3)
+        
+        if probe is not None:
+            center = probe.result()
+            if center != get_geographic_centroid([person.geocoded_location for person in people]):
+                with metrics.stage("places"):
+                    probed_nearby = find_nearby_places_concurrently(
+                        get_search_area_points(people, num_points=5, center=center), location_type, max_results=3)
+            else:
+                probe = None
     
-    # Find places near each search point
     all_places = []
     place_ids_seen = set()
+    probed_keys = set()  # Places only the probed center's searches found
     
-    for point in search_points:
-        nearby_places_data = find_nearby_places(point, location_type, max_results=3)
-        places = parse_places(nearby_places_data)
-        
-        # Add unique places only
-        for place in places:
-            place_key = f"{place.name}_{place.latitude}_{place.longitude}"
-            if place_key not in place_ids_seen:
-                place_ids_seen.add(place_key)
-                all_places.append(place)
-    
-    # Calculate travel times for all people to all places
-    all_places = get_travel_times_optimized(people, all_places)
+    with metrics.stage("parse"):
+        searches = [(data, False) for data in nearby]
+        if probe is not None:
+            searches += [(data, True) for data in probed_nearby]
+        for nearby_places_data, probed in searches:
+            places = parse_places(nearby_places_data)
+            
+            # Add unique places only
+            for place in places:
+                if place.key not in place_ids_seen:
+                    place_ids_seen.add(place.key)
+                    all_places.append(place)
+                    if probed:
+                        probed_keys.add(place.key)
     
-    # Filter out places with invalid travel times for any person
-    valid_places = []
-    for place in all_places:
-        if len(place.travel_times) == len(people) and all(time < 9999 for time in place.travel_times.values()):
-            valid_places.append(place)
+    if on_event is not None:
+        on_event("candidates", {"places": [dict(place.to_dict(), key=place.key) for place in all_places]})
     
-    # Sort by fairness score (lower is better)
-    valid_places.sort(key=lambda p: (p.fairness_score, p.max_travel_time))
+    # Calculate travel times for all people to all places
+    if not PRUNE_CANDIDATES:
+        all_places = get_travel_times_optimized(people, all_places, on_event, refine_strategy=ranking_strategy)
+    elif len(all_places) > max_places:
+        # The fairness cut below decides which places survive, so prune for that
+        all_places = get_travel_times_pruned(people, all_places, "fairness_then_max", max_places, on_event)
+    else:
+        all_places = get_travel_times_pruned(people, all_places, ranking_strategy, ranking_k or max_places,
+                                             on_event)
     
-    return valid_places[:max_places]
+    with metrics.stage("scoring"):
+        # Filter out places with invalid travel times for any person
+        valid_places = [place for place in all_places
+                        if len(place.travel_time_column) == len(people) and np.all(place.travel_time_column < 9999)]
+        
+        # The probed center is only kept if one of its places beats the centroid's best longest trip
+        if probed_keys:
+            def best_max(places):
+                return min((float(place.travel_time_column.max()) for place in places), default=float("inf"))
+            centroid_places = [place for place in valid_places if place.key not in probed_keys]
+            if best_max([place for place in valid_places if place.key in probed_keys]) >= best_max(centroid_places):
+                valid_places = centroid_places
+        
+        # Sort by fairness score (lower is better), only fully sorting the places we keep
+        table = build_score_table(valid_places)
+        return [valid_places[i] for i in table.top_k("fairness_then_max", max_places)]
+
+# Scored (unranked) candidates for recent searches, so re-sorting or repeating a search costs no API calls
+RESULT_CACHE = os.environ.get("RESULT_CACHE", "1") == "1"
+result_cache = PersistentCache(
+    "results",
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", 5000)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 900)),
+    memory_entries=int(os.environ.get("RESULT_CACHE_MEMORY_SIZE", 500)),
+)
+
+def group_member_signature(person: Person) -> str:
+    return f"{normalize_address(person.location)}|{person.transport_mode}"
+
+def group_signature(people: List[Person], location_type: str) -> str:
+    """
+    Canonical key for a search: everyone's normalized address and transport mode plus the place type.
+    Names and the order people were entered in don't change it.
+    """
+    members = sorted(group_member_signature(person) for person in people)
+    return hashlib.sha256(json.dumps([location_type, members]).encode()).hexdigest()
+
+def canonical_order(people: List[Person]) -> List[int]:
+    """Indexes of people in the order group_signature sorts them in"""
+    return sorted(range(len(people)), key=lambda i: group_member_signature(people[i]))
+
+def result_cache_entry(places: List[Place], order: List[int] = None) -> Dict[str, Any]:
+    """
+    result_cache form of a group's scored candidates. Travel times are stored in the canonical
+    order of people; pass that order (see canonical_order) if the places' travel times aren't in it.
+    """
+    return {
+        # Names aren't part of the signature, so only the places themselves are kept
+        'places': [[place.name, place.address, place.rating, place.total_ratings,
+                    place.business_image_link, place.embed_link, place.latitude, place.longitude]
+                   for place in places],
+        'times': [(place.travel_time_column if order is None else place.travel_time_column[order]).tolist()
+                  for place in places],  # [place][canonical person]
+        'errors': [place.travel_time_error for place in places],
+    }
+
+def places_from_result_entry(people: List[Person], entry: Dict[str, Any]) -> List[Place]:
+    """Scored places from a result_cache entry, with travel times mapped back onto people"""
+    places = [Place(*fields) for fields in entry['places']]
+    store = TravelTimes.attach(people, places)
+    positions = np.argsort(canonical_order(people))  # Each person's position in the canonical order
+    times = np.array(entry['times'], dtype=np.float64).reshape(len(places), len(people))
+    store.times[:, :] = times[:, positions].T
+    for place, error in zip(places, entry.get('errors', ())):
+        place.travel_time_error = error
+    score_places(places)
+    return places
+
+def pruned_entry_serves(entry: Dict[str, Any], ranking_strategy: str, ranking_k: Optional[int]) -> bool:
+    """Whether a result_cache entry has every place the top ranking_k by ranking_strategy could need"""
+    pruned_for = entry.get('pruned_for')
+    if pruned_for is None:
+        return True
+    return ranking_k is not None and pruned_for[0] == ranking_strategy and ranking_k <= pruned_for[1]
+
+def get_scored_candidates(people: List[Person], location_type: str, max_places: int = 15,
+                          ranking_strategy: str = "fairness", ranking_k: int = None,
+                          on_event: EventCallback = None) -> List[Place]:
+    """
+    The scored, unranked candidate places for a group, from result_cache when the same group
+    (see group_signature) searched recently.
 
-def rank_places_by_strategy(places: List[Place], strategy: str = "fairness") -> List[Place]:
+    The first search of a group is pruned for ranking_strategy and ranking_k like
+    get_middle_locations_multi_person, and its entry only serves that strategy with at most
+    ranking_k results. Anything else (another sort method, more results, or no ranking_k, as for
+    the candidates API) searches again without pruning, and that entry serves every sort method.
+    Travel times are stored in the canonical (sorted) order of people and mapped back onto
+    people on the way out.
+    """
+    canonical = canonical_order(people)
+    key = group_signature(people, location_type)
+    entry = result_cache.get(key)
+    if entry is None or not pruned_entry_serves(entry, ranking_strategy, ranking_k):
+        if entry is not None:
+            ranking_strategy, ranking_k = "fairness", None  # Sort method changed, keep every candidate this time
+        places = get_middle_locations_multi_person([people[i] for i in canonical], location_type,
+                                                   max_places=max_places, ranking_strategy=ranking_strategy,
+                                                   ranking_k=ranking_k, on_event=on_event)
+        entry = result_cache_entry(places)
+        if PRUNE_CANDIDATES and ranking_k is not None:
+            entry['pruned_for'] = [ranking_strategy, ranking_k]
+        result_cache.set(key, entry)
+        cached = False
+    else:
+        cached = True
+
+    places = places_from_result_entry(people, entry)
+
+    if cached and on_event is not None:
+        on_event("candidates", {"places": [dict(place.to_dict(), key=place.key) for place in places]})
+    return places
+
+def get_all_candidates_for_group(people: List[Person], location_type: str, max_places: int = 15) -> List[Place]:
+    """Every scored candidate place for a group, unranked (cached like get_all_locations_for_group)"""
+    if len(people) < 2:
+        raise ValueError("Need at least 2 people to find a meeting point")
+    if RESULT_CACHE:
+        return get_scored_candidates(people, location_type, max_places=max_places)
+    return get_middle_locations_multi_person(people, location_type, max_places=max_places)
+
+def candidates_to_columns(people: List[Person], places: List[Place]) -> Dict[str, Any]:
+    """
+    Compact, column-oriented JSON form of a group's scored candidates, so a client can re-rank,
+    filter and page through them itself.
+
+    Returns:
+        {"people": {field: [value per person]},
+         "places": {field: [value per place]} including the metrics,
+         "travel_times": [[seconds or None per place] per person],
+         "rankings": {strategy: [place indexes, best first]} for every strategy in STRATEGIES}
+    """
+    table = build_score_table(places)
+    times = table.times if places else np.empty((len(people), 0))
+    return {
+        'people': {
+            'name': [person.name for person in people],
+            'location': [person.location for person in people],
+            'transport': [person.transport_mode for person in people],
+        },
+        'places': {
+            'key': [place.key for place in places],
+            'name': [place.name for place in places],
+            'address': [place.address for place in places],
+            'rating': [place.rating for place in places],
+            'total_ratings': [place.total_ratings for place in places],
+            'latitude': [place.latitude for place in places],
+            'longitude': [place.longitude for place in places],
+            'business_image_link': [place.business_image_link for place in places],
+            'max_travel_time': [place.max_travel_time for place in places],
+            'total_travel_time': [place.total_travel_time for place in places],
+            'travel_time_variance': [place.travel_time_variance for place in places],
+            'fairness_score': [place.fairness_score for place in places],
+        },
+        'travel_times': [[int(time) if time == time else None for time in row] for row in times.tolist()],
+        'rankings': {strategy: table.top_k(strategy).tolist() for strategy in STRATEGIES},
+    }
+
+def rank_places_by_strategy(places: List[Place], strategy: str = "fairness", top_k: int = None) -> List[Place]:
     """
     Rank places by different strategies.
     
     Args:
         places: List of Place objects with calculated metrics
         strategy: Ranking strategy ("fairness", "minimize_max", "minimize_total", "rating")
+        top_k: Only return the best top_k places (cheaper than ranking everything)
     
     Returns:
         Sorted list of places
     """
-    if strategy == "fairness":
-        # Minimize variance in travel times (most fair)
-        return sorted(places, key=lambda p: p.fairness_score)
-    elif strategy == "minimize_max":
-        # Minimize the maximum travel time for anyone
-        return sorted(places, key=lambda p: p.max_travel_time)
-    elif strategy == "minimize_total":
-        # Minimize total travel time for everyone
-        return sorted(places, key=lambda p: p.total_travel_time)
-    elif strategy == "rating":
-        # Prioritize highly rated places, then fairness
-        return sorted(places, key=lambda p: (-p.rating, p.fairness_score))
-    else:
-        return places
+    if strategy not in STRATEGIES:
+        return places[:top_k]
+    table = build_score_table(places)
+    return [places[i] for i in table.top_k(strategy, top_k)]
+
+def count_tiles(people: List[Person], origins: List[Coord], num_places: int) -> int:
+    """How many Distance Matrix tiles everyone's (distinct) origins to num_places places take"""
+    origins_by_mode = {}  # {mode: set of origins}
+    for person, origin in zip(people, origins):
+        origins_by_mode.setdefault(person.transport_mode, set()).add(origin)
+    return sum(len(plan_tiles(len(mode_origins), num_places)) for mode_origins in origins_by_mode.values())
+
+def clustering_saves_requests(people: List[Person], origins: List[Coord], num_places: int, num_exact: int) -> bool:
+    """
+    Whether clustered origins (with exact times to num_exact of the places) take fewer tiles
+    than exact times for everyone. Small clusters don't always, since the exact places need
+    their own tiles.
+    """
+    exact_origins = [person.geocoded_location for person in people]
+    clustered = count_tiles(people, origins, num_places - num_exact) + count_tiles(people, exact_origins, num_exact)
+    return clustered < count_tiles(people, exact_origins, num_places)
+
+def fill_refine_tiles(people: List[Person], needed: List[Place], candidates: List[Place]) -> List[Place]:
+    """
+    needed plus as many of candidates (best first) as fit in the Distance Matrix requests that
+    refining needed takes anyway, so a refine round fills whole tiles
+    """
+    exact_origins = [person.geocoded_location for person in people]
+
+    def requests(num_places: int) -> int:
+        return count_tiles(people, exact_origins, num_places)
+
+    batch = list(needed)
+    chosen = set(map(id, batch))
+    cost = requests(len(batch))
+    for place in candidates:
+        if id(place) in chosen:
+            continue
+        if requests(len(batch) + 1) > cost:
+            break
+        batch.append(place)
+        chosen.add(id(place))
+    return batch
+
+def refine_top_places(people: List[Person], places: List[Place], strategy: str = "fairness",
+                      k: int = CLUSTER_REFINE) -> List[Place]:
+    """
+    Replaces estimated travel times (see cluster_origins) with exact ones for the best k places
+    under strategy. Exact times can reorder the places, so this repeats until the top k are all
+    exact. Places that turn out to be unreachable for someone are dropped.
+
+    The first round is usually done already, with the representatives' travel times (see
+    get_travel_times_optimized's refine_strategy). Each later round also refines the next best
+    estimated places that fit in the requests it makes anyway (see fill_refine_tiles), so it
+    doesn't take another round to reach them.
+
+    Returns the places (with the refined ones rescored), in their original order
+    """
+    for _ in range(len(places)):
+        estimated = [place for place in rank_places_by_strategy(places, strategy, top_k=k) if place.travel_time_error]
+        if not estimated:
+            break
+        if any(person.geocoded_location is None for person in people):
+            people = batch_geocode_people(people)  # Candidates from result_cache skip geocoding
+        estimated = fill_refine_tiles(people, estimated, [place for place in rank_places_by_strategy(places, strategy)
+                                                          if place.travel_time_error])
+        with metrics.stage("refine"):
+            get_travel_times_optimized(people, estimated, cluster=False)
+        print(f"Refined travel times for {len(estimated)} places")
+        places = [place for place in places if np.all(place.travel_time_column < 9999)]
+    return places
 
 # Main wrapper function
 def get_all_locations_for_group(people: List[Person], location_type: str, 
-                               ranking_strategy: str = "fairness", max_results: int = 6) -> List[Place]:
+                               ranking_strategy: str = "fairness", max_results: int = 6,
+                               on_event: EventCallback = None) -> List[Place]:
     """
     Full wrapper function that takes in a list of people and returns recommended meeting places.
     
@@ -557,6 +1326,12 @@ def get_all_locations_for_group(people: List[Person], location_type: str,
         location_type: Type of place to search for
         ranking_strategy: How to rank the results
         max_results: Maximum number of results to return
+        on_event: Optional callback for progress, called as on_event(name, data) with
+            "geocoded" (people and their coordinates), "candidates" (places found, before travel
+            times), "scores" (partial metrics as each distance matrix tile arrives), "pruned"
+            (places skipped) and finally "results" (the ranked places). Places are identified
+            by Place.key. "scores" may be sent from a worker thread. When the result comes from
+            result_cache only "candidates" and "results" are sent.
     
     Returns:
         List of Place objects ranked by the specified strategy
@@ -564,13 +1339,359 @@ def get_all_locations_for_group(people: List[Person], location_type: str,
     if len(people) < 2:
         raise ValueError("Need at least 2 people to find a meeting point")
     
-    # Get potential meeting places
-    places = get_middle_locations_multi_person(people, location_type, max_places=15)
-    
-    # Rank according to strategy
-    ranked_places = rank_places_by_strategy(places, ranking_strategy)
-    
-    return ranked_places[:max_results]
+    try:
+        with metrics.stage("search"):
+            # Get potential meeting places, pruned for this ranking. Switching sort method searches
+            # once more without pruning, after which it only re-ranks the cached candidates
+            if RESULT_CACHE:
+                places = get_scored_candidates(people, location_type, max_places=15,
+                                               ranking_strategy=ranking_strategy, ranking_k=max_results,
+                                               on_event=on_event)
+            else:
+                places = get_middle_locations_multi_person(people, location_type, max_places=15,
+                                                          ranking_strategy=ranking_strategy, ranking_k=max_results,
+                                                          on_event=on_event)
+            
+            # Rank according to strategy, with exact travel times for the best places of a large group
+            places = refine_top_places(people, places, ranking_strategy)
+            with metrics.stage("rank"):
+                places = rank_places_by_strategy(places, ranking_strategy, top_k=max_results)
+    except Exception:
+        metrics.searches.inc(status="error")
+        raise
+    metrics.searches.inc(status="ok" if places else "no_results")
+    if on_event is not None:
+        on_event("results", {"places": [dict(place.to_dict(), key=place.key) for place in places]})
+    return places
+
+# Most groups whose search centers are worked out at once in a bulk search
+GROUP_WORKERS = int(os.environ.get("GROUP_WORKERS", 4))
+# Search points of different groups within this many meters of each other share one Places search
+BULK_PLACES_MERGE_DISTANCE = float(os.environ.get("BULK_PLACES_MERGE_DISTANCE", 300))
+
+def merge_search_points(points: List[Coord], max_distance: float = BULK_PLACES_MERGE_DISTANCE
+                        ) -> Tuple[List[Coord], List[int]]:
+    """
+    Merges points within max_distance meters of an earlier point into it, in order.
+
+    Returns the points that are left and, for each original point, its position among them
+    """
+    if not points:
+        return [], []
+    distances = haversine_matrix(points, points)
+    kept = []  # Indexes into points
+    index = []
+    for i in range(len(points)):
+        near = next((position for position, k in enumerate(kept) if distances[i, k] <= max_distance), None)
+        if near is None:
+            near = len(kept)
+            kept.append(i)
+        index.append(near)
+    return [points[k] for k in kept], index
+
+def get_travel_times_for_groups(groups: List[Tuple[List[Person], List[Place]]], stats: dict = None):
+    """
+    get_travel_times_optimized for several groups at once: every group's per-mode matrices go into
+    one get_travel_time_matrices call, so cells shared between groups are requested once and every
+    group's tiles run concurrently. Large groups are clustered as in get_travel_times_optimized.
+    stats accumulates the element and request counts.
+    """
+    jobs = []
+    job_rows = []  # [(store, person indexes)] per job
+    for people, places in groups:
+        if not people or not places:
+            continue
+        store = TravelTimes.attach(people, places)
+        origins, error = [person.geocoded_location for person in people], 0.0
+        if use_clustering(people):
+            origins, errors = cluster_origins(people)
+            error = float(errors.max())
+        for place in places:
+            place.travel_time_error = error
+        mode_groups = {}  # {mode: [person index, ...]}
+        for person_idx, person in enumerate(people):
+            mode_groups.setdefault(person.transport_mode, []).append(person_idx)
+        for mode, person_indexes in mode_groups.items():
+            jobs.append(([origins[i] for i in person_indexes], [place.coord for place in places], mode))
+            job_rows.append((store, person_indexes))
+    if not jobs:
+        return
+
+    matrix_stats = {}
+    with metrics.stage("distance_matrix"):
+        matrices = get_travel_time_matrices(gmaps, jobs, stats=matrix_stats)
+    if stats is not None:
+        for name, value in matrix_stats.items():
+            stats[name] = stats.get(name, 0) + value
+
+    for (store, person_indexes), matrix in zip(job_rows, matrices):
+        # Unreachable places (or failed requests) get a high penalty time, as in get_travel_times_optimized
+        store.times[person_indexes, :] = [[travel_time if travel_time is not None else 9999 for travel_time in row]
+                                          for row in matrix]
+    for people, places in groups:
+        if places:
+            score_places(places)
+
+def get_travel_times_pruned_for_groups(groups: List[Tuple[List[Person], List[Place]]], strategy: str, k: int,
+                                       stats: dict = None) -> List[List[Place]]:
+    """
+    get_travel_times_pruned for several groups at once: the first k places of every group are
+    looked up together, then whatever each group can't rule out, also together.
+
+    Returns each group's evaluated places
+    """
+    if strategy not in STRATEGIES:
+        strategy = "fairness_then_max"
+    first_round = []
+    plans = []  # Per group: None if every place is evaluated in the first round, else (bounds, the rest)
+    for people, places in groups:
+        if not PRUNE_CANDIDATES or len(places) <= k:
+            first_round.append((people, places))
+            plans.append(None)
+            continue
+        ratings = [place.rating or 0.0 for place in places]
+        bounds = primary_key_lower_bound(ScoreTable(get_travel_time_lower_bounds(people, places), ratings), strategy)
+        if not pruning_can_pay_off(people, places, bounds, strategy, k):
+            first_round.append((people, places))
+            plans.append(None)
+            continue
+        order = np.argsort(bounds, kind="stable")
+        first_round.append((people, [places[i] for i in order[:k]]))
+        plans.append((bounds, order[k:]))
+    get_travel_times_for_groups(first_round, stats)
+
+    second_round = []
+    evaluated = []
+    for (people, places), (_, first), plan in zip(groups, first_round, plans):
+        if plan is None:
+            evaluated.append(places)
+            continue
+        bounds, rest = plan
+        reachable = [place for place in first if np.all(place.travel_time_column < 9999)]
+        if len(reachable) < k:
+            # Not enough valid places to set a threshold, so nothing can be ruled out
+            remaining = [places[i] for i in rest]
+        else:
+            # As in get_travel_times_pruned, allowing for estimated times
+            error = max(place.travel_time_error for place in reachable)
+            keys = primary_key_upper_bound(build_score_table(reachable), strategy, error)
+            threshold = np.partition(keys, k - 1)[k - 1]
+            remaining = [places[i] for i in rest if bounds[i] <= threshold]
+        second_round.append((people, remaining))
+        kept = set(map(id, first + remaining))
+        evaluated.append([place for place in places if id(place) in kept])
+    get_travel_times_for_groups(second_round, stats)
+    return evaluated
+
+def get_all_locations_for_groups(groups: List[List[Person]], location_types: List[str],
+                                 ranking_strategy: str = "fairness", max_results: int = 6,
+                                 stats: dict = None) -> List[Tuple[Optional[List[Place]], Optional[str]]]:
+    """
+    get_all_locations_for_group for many groups at once (e.g. every team lunch in an office),
+    sharing the API calls between them:
+
+    1. Groups that searched recently are answered from result_cache
+    2. Everyone else's addresses are geocoded together, so shared addresses are looked up once
+    3. Search points of groups looking for the same place type that are within
+       BULK_PLACES_MERGE_DISTANCE of each other share one Places search
+    4. Every group's travel time cells are merged into one Distance Matrix lookup (see
+       get_travel_times_pruned_for_groups)
+
+    Args:
+        groups: The people in each group
+        location_types: Type of place to search for, per group
+        ranking_strategy: How to rank each group's results
+        max_results: Maximum number of results per group
+        stats: Optional dict that is filled with counts of groups, addresses, searches and elements
+
+    Returns:
+        Per group, (ranked places, None) or (None, error message) if that group's search failed
+    """
+    stats = {} if stats is None else stats
+    stats.update(groups=len(groups), cached_groups=0, duplicate_groups=0)
+    results = [None] * len(groups)
+    pending = []  # Group numbers still to search
+    duplicates = {}  # {group number: number of the identical pending group it copies}
+    with metrics.stage("search"):
+        first_with_signature = {}
+        for number, people in enumerate(groups):
+            if len(people) < 2:
+                results[number] = (None, "Need at least 2 people to find a meeting point")
+                continue
+            signature = group_signature(people, location_types[number])
+            entry = result_cache.get(signature) if RESULT_CACHE else None
+            if entry is not None:
+                results[number] = (places_from_result_entry(people, entry), None)
+                stats["cached_groups"] += 1
+            elif signature in first_with_signature:
+                duplicates[number] = first_with_signature[signature]
+                stats["duplicate_groups"] += 1
+            else:
+                first_with_signature[signature] = number
+                pending.append(number)
+
+        # Geocode everyone at once; a failure only fails the groups it belongs to
+        everyone = [person for number in pending + list(duplicates) for person in groups[number]]
+        stats["addresses"] = len({normalize_address(person.location) for person in everyone})
+        with metrics.stage("geocode"):
+            try:
+                batch_geocode_people(everyone)
+            except Exception as e:
+                print(f"Bulk geocoding error: {e}")
+        searchable = []
+        for number in pending + list(duplicates):
+            missing = [person for person in groups[number] if person.geocoded_location is None]
+            if missing:
+                results[number] = (None, "; ".join(f"Could not geocode location for {person.name}: {person.location}"
+                                                   for person in missing))
+            elif number in pending:
+                searchable.append(number)
+
+        # Without the result cache the candidates can be tailored to the ranking strategy, as for one group
+        center_strategy = "fairness" if RESULT_CACHE else ranking_strategy
+        with metrics.stage("search_points"):
+            with ThreadPoolExecutor(max_workers=max(1, min(GROUP_WORKERS, len(searchable)))) as executor:
+                centers = list(executor.map(lambda number: get_fair_search_center(groups[number], center_strategy),
+                                            searchable))
+            search_points = {number: get_search_area_points(groups[number], num_points=5, center=center)
+                             for number, center in zip(searchable, centers)}
+
+        # One Places search per merged search point and place type
+        nearby = {}  # {group number: [Places results per search point]}
+        stats["places_searches_needed"] = sum(len(points) for points in search_points.values())
+        stats["places_searches"] = 0
+        for location_type in dict.fromkeys(location_types[number] for number in searchable):
+            numbers = [number for number in searchable if location_types[number] == location_type]
+            points = [point for number in numbers for point in search_points[number]]
+            merged, index = merge_search_points(points)
+            stats["places_searches"] += len(merged)
+            with metrics.stage("places"):
+                found = find_nearby_places_concurrently(merged, location_type, max_results=3)
+            position = 0
+            for number in numbers:
+                nearby[number] = [found[index[position + i]] for i in range(len(search_points[number]))]
+                position += len(search_points[number])
+
+        candidates = []
+        with metrics.stage("parse"):
+            for number in searchable:
+                # Every group gets its own Place objects, as they hold the group's travel times
+                places = {}
+                for nearby_places_data in nearby[number]:
+                    for place in parse_places(nearby_places_data):
+                        places.setdefault(place.key, place)
+                candidates.append((groups[number], list(places.values())))
+
+        max_places = 15
+        if RESULT_CACHE:
+            evaluated = get_travel_times_pruned_for_groups(candidates, "fairness_then_max", max_places, stats)
+        else:
+            evaluated = get_travel_times_pruned_for_groups(candidates, ranking_strategy, max_results, stats)
+
+        for number, places in zip(searchable, evaluated):
+            people = groups[number]
+            with metrics.stage("scoring"):
+                valid_places = [place for place in places if np.all(place.travel_time_column < 9999)]
+                table = build_score_table(valid_places)
+                places = [valid_places[i] for i in table.top_k("fairness_then_max", max_places)]
+            entry = result_cache_entry(places, canonical_order(people))
+            if RESULT_CACHE:
+                result_cache.set(group_signature(people, location_types[number]), entry)
+            results[number] = (places, None)
+            for duplicate in [d for d, original in duplicates.items() if original == number]:
+                if results[duplicate] is None:
+                    results[duplicate] = (places_from_result_entry(groups[duplicate], entry), None)
+
+        results = [(refine_top_places(people, places, ranking_strategy), None) if places is not None else (None, error)
+                   for people, (places, error) in zip(groups, results)]
+        with metrics.stage("rank"):
+            results = [(rank_places_by_strategy(places, ranking_strategy, top_k=max_results), None)
+                       if places is not None else (None, error) for places, error in results]
+
+    for places, error in results:
+        metrics.searches.inc(status="error" if error else "ok" if places else "no_results")
+    return results
+
+# Seconds a stored Meeting is served again for an identical search instead of running it (0 to disable)
+MEETING_REUSE_TTL = float(os.environ.get("MEETING_REUSE_TTL", 900))
+
+_meeting_table_lock = threading.Lock()
+_meeting_table_ready = False
+
+def ensure_meeting_table():
+    """
+    Creates the meeting table and its index on first use, and adds any columns missing from a
+    table created by an older version (init_db.py used to create it without the snapshot columns).
+    Needs an app context.
+    """
+    global _meeting_table_ready
+    if _meeting_table_ready:
+        return
+    with _meeting_table_lock:
+        if _meeting_table_ready:
+            return
+        # Another worker may be doing the same; whatever it created first is just as good
+        try:
+            Meeting.__table__.create(db.engine, checkfirst=True)
+        except OperationalError as e:
+            print(f"Meeting table: {e}")
+        existing = {column["name"] for column in db.inspect(db.engine).get_columns(Meeting.__tablename__)}
+        for column in Meeting.__table__.columns:
+            if column.name not in existing:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(db.text(f"ALTER TABLE {Meeting.__tablename__} ADD COLUMN "
+                                             f"{column.name} {column.type.compile(db.engine.dialect)}"))
+                except OperationalError as e:
+                    print(f"Meeting table: {e}")
+        for index in Meeting.__table__.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except OperationalError as e:
+                print(f"Meeting table: {e}")
+        _meeting_table_ready = True
+
+def save_meeting(people: List[Person], location_type: str, sort_method: str, places: List[Place]) -> Meeting:
+    """
+    Stores a computed search as a Meeting snapshot. Needs an app context.
+
+    Returns:
+        meeting (Meeting): The saved snapshot, whose random token is its permalink (sequential ids
+            would let anyone page through everyone's addresses)
+    """
+    ensure_meeting_table()
+    meeting = Meeting(token=secrets.token_urlsafe(16), place_type=location_type, sort_method=sort_method,
+                      group_signature=group_signature(people, location_type), created_at=time.time())
+    meeting.set_people_data(people)
+    meeting.set_places(places)
+    db.session.add(meeting)
+    db.session.commit()
+    return meeting
+
+def get_meeting(token: str) -> Optional[Meeting]:
+    """The stored Meeting with this permalink token, if any. Needs an app context."""
+    ensure_meeting_table()
+    return Meeting.query.filter_by(token=token).first()
+
+def find_recent_meeting(people: List[Person], location_type: str, sort_method: str,
+                        max_age: float = MEETING_REUSE_TTL) -> Optional[Meeting]:
+    """
+    The newest Meeting for exactly this search (same people, in the same order, place type and
+    sort method) stored in the last max_age seconds, if any. Needs an app context.
+    """
+    if max_age <= 0:
+        return None
+    ensure_meeting_table()
+    wanted = Meeting()
+    wanted.set_people_data(people)
+    # The index narrows this to the group's recent snapshots; names and order are checked on those
+    candidates = Meeting.query.filter(
+        Meeting.group_signature == group_signature(people, location_type),
+        Meeting.place_type == location_type,
+        Meeting.sort_method == sort_method,
+        Meeting.created_at >= time.time() - max_age,
+    ).order_by(Meeting.created_at.desc()).limit(20).all()
+    return next((meeting for meeting in candidates if meeting.meeting_data == wanted.meeting_data), None)
 
 # Convenience function for the original two-person interface
 def get_all_locations_classes(location_a: str, location_b: str, mode_a: str, mode_b: str, location_type: str):
@@ -603,31 +1724,13 @@ def print_meeting_analysis(places: List[Place], people: List[Person]):
         print()
 
 def get_location_suggestions(query: str, api_key: str) -> List[Dict[str, Any]]:
-    """Get location suggestions using Google Places Autocomplete API"""
+    """
+    Get location suggestions using Google Places Autocomplete API.
+    Served from autocomplete_cache where possible (see autocomplete.py)
+    """
     try:
-        url = "https://maps.googleapis.com/maps/api/place/autocomplete/json"
-        params = {
-            'input': query,
-            'key': api_key,
-            'components': 'country:au',  # Restrict to Australia
-            'types': 'address'
-        }
-        
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        suggestions = []
-        
-        if data.get('status') == 'OK':
-            for prediction in data.get('predictions', []):
-                suggestions.append({
-                    'description': prediction.get('description', ''),
-                    'place_id': prediction.get('place_id', '')
-                })
-        
-        return suggestions[:5]  # Return top 5 suggestions
+        return autocomplete_cache.get(query, api_key)  # Top 5 suggestions
         
     except Exception as e:
         print(f"Error getting location suggestions: {e}")
-        return []
\ No newline at end of file
+        return []
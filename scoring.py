@@ -0,0 +1,113 @@
+from typing import List, Sequence
+
+import numpy as np
+
+# Ranking strategies understood by ScoreTable.top_k
+STRATEGIES = ("fairness", "minimize_max", "minimize_total", "rating")
+
+
+class ScoreTable:
+    """
+    Scores every candidate place at once.
+
+    Travel times are held as a people x places matrix (seconds, NaN where a person has
+    no travel time for a place). Max, total, variance and fairness for all places are
+    computed in one vectorized pass, and top_k picks the best places for a strategy
+    with a partial selection instead of sorting every candidate.
+    """
+    def __init__(self, times: np.ndarray, ratings: Sequence[float] = None):
+        self.times = np.asarray(times, dtype=np.float64)
+        if self.times.ndim != 2:
+            raise ValueError("Travel times must be a people x places matrix")
+        num_places = self.times.shape[1]
+        self.ratings = (np.zeros(num_places) if ratings is None
+                        else np.asarray(ratings, dtype=np.float64))
+
+        # Places nobody has a travel time for score 0 everywhere, like Place.calculate_metrics
+        known = ~np.isnan(self.times)
+        counts = known.sum(axis=0)
+        filled = np.where(known, self.times, 0.0)
+        self.total = filled.sum(axis=0)
+        self.max = np.where(known, self.times, -np.inf).max(axis=0, initial=-np.inf)
+        self.max[counts == 0] = 0.0
+        mean = np.divide(self.total, counts, out=np.zeros(num_places), where=counts > 0)
+        squared = np.where(known, (self.times - mean) ** 2, 0.0).sum(axis=0)
+        self.variance = np.divide(squared, counts, out=np.zeros(num_places), where=counts > 0)
+
+        # Fairness score combines variance and max time (lower is better)
+        self.fairness = (self.variance + self.max * 0.1) / 10000
+
+    def sort_keys(self, strategy: str) -> List[np.ndarray]:
+        """The sort keys for a strategy, most significant first (lower is better)"""
+        if strategy == "fairness":
+            return [self.fairness]
+        if strategy == "minimize_max":
+            return [self.max]
+        if strategy == "minimize_total":
+            return [self.total]
+        if strategy == "rating":
+            # Prioritize highly rated places, then fairness
+            return [-self.ratings, self.fairness]
+        if strategy == "fairness_then_max":
+            return [self.fairness, self.max]
+        raise ValueError(f"Unknown ranking strategy: {strategy}")
+
+    def top_k(self, strategy: str, k: int = None) -> np.ndarray:
+        """
+        Indexes of the k best places for strategy, best first.
+
+        Ties keep their original order, so the result matches a stable full sort.
+        """
+        keys = self.sort_keys(strategy)
+        num_places = self.times.shape[1]
+        if k is None or k >= num_places:
+            candidates = np.arange(num_places)
+        elif k <= 0:
+            return np.arange(0)
+        else:
+            # Everything that can be in the top k: at most the kth smallest primary key
+            kth = np.partition(keys[0], k - 1)[k - 1]
+            candidates = np.flatnonzero(keys[0] <= kth)
+
+        # np.lexsort sorts by the last key first; the index keeps ties stable
+        order = np.lexsort([candidates] + [key[candidates] for key in reversed(keys)])
+        return candidates[order][:k]
+
+
+def primary_key_lower_bound(bounds: ScoreTable, strategy: str) -> np.ndarray:
+    """
+    A lower bound on each place's primary sort key for strategy, given a ScoreTable
+    built from lower bounds on the travel times (e.g. straight-line distance / top speed).
+
+    Variance can't be bounded from below without upper bounds on the times, so the
+    fairness bound only uses its max travel time term.
+    """
+    if strategy in ("fairness", "fairness_then_max"):
+        return bounds.max * 0.1 / 10000
+    if strategy == "minimize_max":
+        return bounds.max
+    if strategy == "minimize_total":
+        return bounds.total
+    if strategy == "rating":
+        return -bounds.ratings
+    raise ValueError(f"Unknown ranking strategy: {strategy}")
+
+
+def primary_key_upper_bound(table: ScoreTable, strategy: str, error: float = 0.0) -> np.ndarray:
+    """
+    An upper bound on each place's primary sort key for strategy, given a ScoreTable of
+    travel times that may each be off by up to error seconds (e.g. estimated from clustered
+    origins). With no error this is just the primary key.
+
+    Shifting every time by at most error raises the max by at most error, the total by error
+    per person and the standard deviation by at most error.
+    """
+    if error <= 0 or strategy == "rating":
+        return table.sort_keys(strategy)[0]
+    if strategy in ("fairness", "fairness_then_max"):
+        return ((np.sqrt(table.variance) + error) ** 2 + (table.max + error) * 0.1) / 10000
+    if strategy == "minimize_max":
+        return table.max + error
+    if strategy == "minimize_total":
+        return table.total + error * table.times.shape[0]
+    raise ValueError(f"Unknown ranking strategy: {strategy}")
@@ -0,0 +1,186 @@
+// Fills in the route page from /search/stream as the search runs
+
+const cards = new Map(); // place key -> card element
+
+function element(tag, className, text) {
+    const el = document.createElement(tag);
+    if (className) el.className = className;
+    if (text !== undefined) el.textContent = text;
+    return el;
+}
+
+function minutes(seconds) {
+    return Math.round(seconds / 60);
+}
+
+function setStatus(text) {
+    document.getElementById('streamStatus').textContent = text;
+}
+
+function createCard(place, starIcon) {
+    const card = element('div', 'location-format pending');
+    card.addEventListener('click', () => updateMap(place.latitude, place.longitude));
+
+    card.appendChild(element('h3', 'location-title', place.name));
+    const content = element('div', 'location-content');
+
+    // Column 1: Ratings & Travel Times
+    const details = element('div', 'content-column');
+    const ratingSection = element('div', 'rating-section');
+    const rating = element('div', 'rating');
+    const star = element('img', 'small-icon-a');
+    star.src = starIcon;
+    star.alt = 'star';
+    rating.appendChild(star);
+    rating.appendChild(document.createTextNode(place.rating
+        ? ` ${place.rating} / 5 (${place.total_ratings} reviews)`
+        : ' No ratings available'));
+    ratingSection.appendChild(rating);
+    details.appendChild(ratingSection);
+
+    const travelTimes = element('div', 'travel-times');
+    travelTimes.appendChild(element('h4', '', 'Travel Times:'));
+    details.appendChild(travelTimes);
+    content.appendChild(details);
+
+    // Column 2: Stats
+    const statsColumn = element('div', 'content-column');
+    const stats = element('div', 'place-stats');
+    stats.appendChild(element('h4', '', 'Meeting Stats:'));
+    statsColumn.appendChild(stats);
+    content.appendChild(statsColumn);
+
+    // Column 3: Image
+    const imageColumn = element('div', 'image-column');
+    const image = element('img', 'place-img');
+    image.src = place.business_image_link || '';
+    image.alt = `Image of ${place.name}`;
+    imageColumn.appendChild(image);
+    content.appendChild(imageColumn);
+    card.appendChild(content);
+
+    // Footer with address and maps link
+    const footer = element('div', 'location-footer');
+    footer.appendChild(element('div', 'location-address', place.address));
+    const link = element('a', 'maps-link', 'View on Google Maps');
+    link.href = `https://www.google.com/maps?q=${encodeURIComponent(place.name)}`;
+    link.target = '_blank';
+    footer.appendChild(link);
+    card.appendChild(footer);
+
+    return card;
+}
+
+function updateScores(card, scores) {
+    const travelTimes = card.querySelector('.travel-times');
+    travelTimes.replaceChildren(element('h4', '', 'Travel Times:'));
+    scores.travel_times.forEach(([personName, seconds]) => {
+        const row = element('div', 'travel-time');
+        row.appendChild(element('strong', '', `${personName}:`));
+        row.appendChild(document.createTextNode(` ${minutes(seconds)} min`));
+        travelTimes.appendChild(row);
+    });
+
+    const stats = card.querySelector('.place-stats');
+    const suffix = scores.complete ? '' : ' so far';
+    stats.replaceChildren(element('h4', '', 'Meeting Stats:'));
+    [['Max travel time:', `${minutes(scores.max_travel_time)} minutes${suffix}`],
+     ['Total travel time:', `${minutes(scores.total_travel_time)} minutes${suffix}`],
+     ['Fairness score:', scores.fairness_score.toFixed(2) + suffix]].forEach(([label, value]) => {
+        const row = element('div');
+        row.appendChild(element('strong', '', label));
+        row.appendChild(document.createTextNode(` ${value}`));
+        stats.appendChild(row);
+    });
+    if (scores.travel_time_error) {
+        // Large groups get estimated times until the best places are worked out exactly
+        stats.appendChild(element('div', 'estimate',
+            `Travel times estimated, within ${Math.ceil(scores.travel_time_error / 60)} minutes`));
+    }
+    card.classList.toggle('pending', !scores.complete);
+}
+
+function showError(message) {
+    document.getElementById('streamResults').hidden = true;
+    document.getElementById('streamErrorText').textContent = message;
+    document.getElementById('streamError').hidden = false;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const container = document.getElementById('streamResults');
+    if (!container) return;
+
+    const list = document.getElementById('placeList');
+    const starIcon = container.dataset.starIcon;
+    const source = new EventSource(container.dataset.streamUrl);
+
+    source.addEventListener('geocoded', () => setStatus('Looking for places in the middle...'));
+
+    source.addEventListener('candidates', (e) => {
+        const places = JSON.parse(e.data).places;
+        places.forEach((place) => {
+            const card = createCard(place, starIcon);
+            cards.set(place.key, card);
+            list.appendChild(card);
+        });
+        if (places.length) {
+            updateMap(places[0].latitude, places[0].longitude);
+            setStatus(`Found ${places.length} places, working out travel times...`);
+        }
+    });
+
+    source.addEventListener('scores', (e) => {
+        JSON.parse(e.data).places.forEach((scores) => {
+            const card = cards.get(scores.key);
+            if (card) updateScores(card, scores);
+        });
+    });
+
+    source.addEventListener('pruned', (e) => {
+        // These places can't make the final list, so they're never scored
+        JSON.parse(e.data).keys.forEach((key) => {
+            const card = cards.get(key);
+            if (card) card.remove();
+            cards.delete(key);
+        });
+    });
+
+    source.addEventListener('results', (e) => {
+        const places = JSON.parse(e.data).places;
+        const keep = new Set(places.map((place) => place.key));
+        cards.forEach((card, key) => {
+            if (!keep.has(key)) card.remove();
+        });
+        // Put the cards in their final order
+        places.forEach((place) => {
+            const card = cards.get(place.key) || createCard(place, starIcon);
+            updateScores(card, Object.assign({}, place, { complete: true }));
+            list.appendChild(card);
+        });
+        if (places.length) {
+            updateMap(places[0].latitude, places[0].longitude);
+            setStatus('');
+        } else {
+            showError("We couldn't find any suitable meeting locations for your group. Try adjusting your search criteria or locations.");
+        }
+    });
+
+    source.addEventListener('error', (e) => {
+        // Server-sent "error" events carry data; connection errors don't. Either way, don't
+        // let the browser reconnect, as that would start the search again.
+        showError(e.data ? JSON.parse(e.data).error : 'Lost connection to the server, please try again.');
+        source.close();
+    });
+
+    source.addEventListener('meeting', (e) => {
+        // The results were saved: show their permalink
+        const url = new URL(JSON.parse(e.data).url, window.location.href).href;
+        const permalink = document.getElementById('streamPermalink');
+        const link = permalink.querySelector('a');
+        link.href = url;
+        link.textContent = url;
+        permalink.hidden = false;
+    });
+
+    source.addEventListener('done', () => source.close());
+});
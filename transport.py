@@ -0,0 +1,160 @@
+import os
+import random
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from maps_backend import MAPS_FIXTURE_DIR, RecordingClient, ReplayClient
+from metrics import InstrumentedClient
+
+if TYPE_CHECKING:
+    import googlemaps
+
+# One HTTP transport per worker process, shared by every Google Maps call
+# (geocode, places_nearby, distance_matrix and autocomplete), so TLS connections are reused.
+MAPS_POOL_SIZE = int(os.environ.get("MAPS_POOL_SIZE", 32))
+MAPS_CONNECT_TIMEOUT = float(os.environ.get("MAPS_CONNECT_TIMEOUT", 3.05))
+MAPS_READ_TIMEOUT = float(os.environ.get("MAPS_READ_TIMEOUT", 10))
+# Retries for connection problems; googlemaps retries 5xx itself, OVER_QUERY_LIMIT is retried by QuotaRetryClient
+MAPS_RETRIES = int(os.environ.get("MAPS_RETRIES", 2))
+# 5xx and OVER_QUERY_LIMIT responses are retried for up to this many seconds
+MAPS_RETRY_TIMEOUT = int(os.environ.get("MAPS_RETRY_TIMEOUT", 15))
+MAPS_QUERIES_PER_SECOND = int(os.environ.get("MAPS_QUERIES_PER_SECOND", 100))
+# Seconds an idle pooled connection waits before TCP keep-alive probes start
+MAPS_KEEPALIVE_IDLE = int(os.environ.get("MAPS_KEEPALIVE_IDLE", 30))
+# "live" calls Google, "record" calls Google and saves every response to MAPS_FIXTURE_DIR,
+# "replay" answers from those recordings offline (see maps_backend.py)
+MAPS_BACKEND = os.environ.get("MAPS_BACKEND", "live")
+# Simulated per-call latency (seconds) and per-element Distance Matrix latency for the replay backend
+MAPS_REPLAY_LATENCY = float(os.environ.get("MAPS_REPLAY_LATENCY", 0))
+MAPS_REPLAY_ELEMENT_LATENCY = float(os.environ.get("MAPS_REPLAY_ELEMENT_LATENCY", 0))
+# What the replay backend does with requests that weren't recorded: "synthetic" or "error"
+MAPS_REPLAY_MISSING = os.environ.get("MAPS_REPLAY_MISSING", "synthetic")
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that turns on TCP keep-alive, so idle pooled connections aren't dropped silently"""
+    def init_poolmanager(self, *args, **kwargs):
+        options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            options += [(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, MAPS_KEEPALIVE_IDLE),
+                        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
+                        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)]
+        kwargs["socket_options"] = options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class QuotaRetryClient:
+    """
+    Retries calls rejected with OVER_QUERY_LIMIT, with jittered exponential backoff, for up to
+    retry_timeout seconds.
+
+    googlemaps can retry these itself, but then a quota rejection only surfaces as a Timeout once
+    it gives up. Wrapped around an InstrumentedClient, every rejected attempt is counted in
+    maps_calls_total with status OVER_QUERY_LIMIT.
+    """
+    def __init__(self, client, retry_timeout: float = MAPS_RETRY_TIMEOUT):
+        self._client = client
+        self.retry_timeout = retry_timeout
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        def call(*args, **kwargs):
+            deadline = time.monotonic() + self.retry_timeout
+            delay = 0.5
+            while True:
+                try:
+                    return attribute(*args, **kwargs)
+                except Exception as e:
+                    if getattr(e, "status", None) != "OVER_QUERY_LIMIT" or time.monotonic() + delay > deadline:
+                        raise
+                time.sleep(delay * (0.5 + random.random()))
+                delay = min(delay * 1.5, 8.0)
+        return call
+
+
+_lock = threading.Lock()
+_pid = None
+_session = None
+_client = None
+
+
+def _reset_after_fork():
+    """Connections must not be shared between processes, so each worker builds its own"""
+    global _pid, _session, _client
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _session = None
+        _client = None
+
+
+def get_session() -> requests.Session:
+    """The pooled requests.Session for this process"""
+    global _session
+    with _lock:
+        _reset_after_fork()
+        if _session is None:
+            session = requests.Session()
+            adapter = KeepAliveAdapter(
+                pool_connections=4,
+                pool_maxsize=MAPS_POOL_SIZE,
+                max_retries=Retry(total=MAPS_RETRIES, connect=MAPS_RETRIES, read=MAPS_RETRIES,
+                                  status=0, backoff_factor=0.2, allowed_methods=["GET"]),
+            )
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def get_timeout() -> tuple:
+    """(connect, read) timeout for calls made directly on the session"""
+    return (MAPS_CONNECT_TIMEOUT, MAPS_READ_TIMEOUT)
+
+
+def get_client() -> "googlemaps.Client":
+    """
+    The googlemaps.Client for this process, built on the shared session (every call, and every
+    OVER_QUERY_LIMIT retry, is counted in /metrics). With MAPS_BACKEND=replay an offline
+    ReplayClient is returned instead.
+    """
+    global _client
+    session = get_session()
+    with _lock:
+        if _client is None:
+            if MAPS_BACKEND == "replay":
+                client = ReplayClient(MAPS_FIXTURE_DIR, latency=MAPS_REPLAY_LATENCY,
+                                      element_latency=MAPS_REPLAY_ELEMENT_LATENCY, missing=MAPS_REPLAY_MISSING)
+            else:
+                import googlemaps  # only needed once the first live call is made
+
+                client = googlemaps.Client(
+                    key=os.environ.get("GOOG_API_KEY"),
+                    connect_timeout=MAPS_CONNECT_TIMEOUT,
+                    read_timeout=MAPS_READ_TIMEOUT,
+                    retry_timeout=MAPS_RETRY_TIMEOUT,
+                    queries_per_second=MAPS_QUERIES_PER_SECOND,
+                    # Retried by QuotaRetryClient instead, so each rejection is counted
+                    retry_over_query_limit=False,
+                    requests_session=session,
+                )
+                if MAPS_BACKEND == "record":
+                    client = RecordingClient(client, MAPS_FIXTURE_DIR)
+            _client = QuotaRetryClient(InstrumentedClient(client))
+        return _client
+
+
+class LazyClient:
+    """
+    Module-level stand-in for get_client(): the client is only built when a method is first
+    used, so importing a module neither loads googlemaps nor validates the API key
+    """
+    def __getattr__(self, name):
+        return getattr(get_client(), name)